@@ -0,0 +1,391 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""
+A local stand-in for the Bluescape endpoints the extension uses, for benchmarking
+uploads without a Bluescape tenant. Elements are only kept in memory and image
+data is read and thrown away.
+
+Every request is delayed by the configured latency, and request and response
+bodies are throttled to the configured bandwidth. Counters of the requests and
+bytes are served at /_stats, and POST /_reset clears them along with the workspace.
+
+Run it on its own to point the extension at it:
+
+    python benchmarks/fake_bluescape.py --port 8765 --latency 0.05 --bandwidth 10
+    BS_API_BASE_DOMAIN=http://127.0.0.1:8765 BS_ANALYTICS_BASE_DOMAIN=http://127.0.0.1:8765 ./webui.sh
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+chunk_size = 64 * 1024
+canvas_padding = 100
+
+class FakeBluescape:
+    """
+    The in-memory workspaces, and the request counters.
+    """
+
+    def __init__(self, latency = 0.0, bandwidth = None, num_canvases = 0):
+        """
+        :param latency: Seconds added to every request.
+        :param bandwidth: Bytes per second for request and response bodies, or None for unlimited.
+        Shared by all connections, like the uplink of a user would be.
+        :param num_canvases: Canvases created in each workspace on reset, to simulate a busy workspace.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.num_canvases = num_canvases
+        self.lock = threading.Lock()
+        # When the link is free to transfer more bytes
+        self.link_free_at = 0.0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # Elements by workspace, in the order they were created
+            self.workspaces = {}
+            self.uploads = {}
+            self.requests = {}
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "request_count": sum(self.requests.values()),
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "elements": sum(len(elements) for elements in self.workspaces.values())
+            }
+
+    def throttle(self, num_bytes):
+        """
+        Waits until num_bytes could have been transferred over the link, after
+        everything that is already being transferred.
+        """
+        if not self.bandwidth:
+            return
+        with self.lock:
+            now = time.perf_counter()
+            self.link_free_at = max(self.link_free_at, now) + num_bytes / self.bandwidth
+            wait = self.link_free_at - now
+        time.sleep(wait)
+
+    def count(self, endpoint, bytes_received, bytes_sent):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_received += bytes_received
+            self.bytes_sent += bytes_sent
+
+    def get_elements(self, workspace_id):
+        with self.lock:
+            if workspace_id not in self.workspaces:
+                self.workspaces[workspace_id] = []
+                # A row of existing canvases, like earlier uploads by other users would leave
+                for i in range(self.num_canvases):
+                    self.workspaces[workspace_id].append(create_element({
+                        "type": "Canvas",
+                        "name": f"Existing canvas {i}",
+                        "style": {"width": 3000, "height": 2000},
+                        "transform": {"x": i * (3000 + canvas_padding), "y": 0},
+                        "traits": {"content": {}}
+                    }))
+            return self.workspaces[workspace_id]
+
+    def add_element(self, workspace_id, element):
+        elements = self.get_elements(workspace_id)
+        with self.lock:
+            elements.append(element)
+
+    def find_element(self, workspace_id, element_id):
+        for element in self.get_elements(workspace_id):
+            if element["id"] == element_id:
+                return element
+        return None
+
+    def find_available_area(self, workspace_id, area, direction):
+        canvases = [get_bounding_box(element) for element in self.get_elements(workspace_id) if element["type"] == "Canvas"]
+        x, y, width, height = area["x"], area["y"], area["width"], area["height"]
+
+        while True:
+            overlapping = [c for c in canvases if x < c[0] + c[2] and c[0] < x + width and y < c[1] + c[3] and c[1] < y + height]
+            if not overlapping:
+                return {"x": x, "y": y, "width": width, "height": height}
+            if direction == "Down":
+                y = max(c[1] + c[3] for c in overlapping) + canvas_padding
+            else:
+                x = max(c[0] + c[2] for c in overlapping) + canvas_padding
+
+def create_element(body):
+    element = dict(body)
+    element["id"] = uuid.uuid4().hex[:20]
+    element["createdAt"] = time.time()
+    if element["type"] == "Image" and "style" not in element:
+        element["style"] = {"width": body.get("width", 0), "height": body.get("height", 0)}
+    return element
+
+def get_bounding_box(element):
+    transform = element.get("transform") or {}
+    style = element.get("style") or {}
+    return (transform.get("x", 0), transform.get("y", 0), style.get("width", 0), style.get("height", 0))
+
+class FakeBluescapeHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the connection pooling of the extension is part of the measurement
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("POST", re.compile(r"^/v3/workspaces/([^/]+)/findAvailableArea$"), "find_available_area"),
+        ("GET", re.compile(r"^/v3/workspaces/([^/]+)/elements$"), "list_elements"),
+        ("POST", re.compile(r"^/v3/workspaces/([^/]+)/elements$"), "create_element"),
+        ("GET", re.compile(r"^/v3/workspaces/([^/]+)/elements/([^/]+)$"), "get_element"),
+        ("DELETE", re.compile(r"^/v3/workspaces/([^/]+)/elements/([^/]+)$"), "delete_element"),
+        ("PUT", re.compile(r"^/v3/workspaces/([^/]+)/assets/uploads/([^/]+)$"), "finish_asset"),
+        ("POST", re.compile(r"^/s3/([^/]+)$"), "upload_asset"),
+        ("GET", re.compile(r"^/v3/users/me$"), "get_user"),
+        ("GET", re.compile(r"^/v3/users/me/workspaces$"), "list_workspaces"),
+        ("POST", re.compile(r"^/api/v3/collect$"), "collect"),
+        ("GET", re.compile(r"^/_stats$"), "stats"),
+        ("POST", re.compile(r"^/_reset$"), "reset"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        fake: FakeBluescape = self.server.fake
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            name = None
+
+        body = self.read_body()
+
+        if name not in ("stats", "reset") and fake.latency:
+            time.sleep(fake.latency)
+
+        if name is None:
+            status, response = 404, {"message": f"No fake for {method} {url.path}"}
+        else:
+            status, response = getattr(self, name)(fake, body, *match.groups())
+
+        sent = self.write_response(status, response)
+        if name not in ("stats", "reset"):
+            fake.count(f"{method} {name}", len(body), sent)
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Trailers, up to the empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(self.read_throttled(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+
+        return self.read_throttled(int(self.headers.get("Content-Length") or 0))
+
+    def read_throttled(self, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.rfile.read(min(chunk_size, length - len(data)))
+            if not chunk:
+                break
+            data += chunk
+            self.server.fake.throttle(len(chunk))
+        return bytes(data)
+
+    def write_response(self, status, response):
+        if response is None:
+            data = b""
+        elif isinstance(response, bytes):
+            data = response
+        else:
+            data = json.dumps(response).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            self.server.fake.throttle(len(chunk))
+            self.wfile.write(chunk)
+        return len(data)
+
+    # Endpoints
+
+    def find_available_area(self, fake: FakeBluescape, body, workspace_id):
+        request = json.loads(body)
+        return 200, fake.find_available_area(workspace_id, request["proposedArea"], request.get("direction"))
+
+    def list_elements(self, fake: FakeBluescape, body, workspace_id):
+        if "cursor" in self.query:
+            element_type, order, page_size, offset = self.query["cursor"][0].split("|")
+            page_size, offset = int(page_size), int(offset)
+        else:
+            element_type = self.query.get("type", [""])[0]
+            order = self.query.get("orderBy", [""])[0]
+            page_size = int(self.query.get("pageSize", ["100"])[0])
+            offset = 0
+
+        elements = [element for element in fake.get_elements(workspace_id) if not element_type or element["type"] == element_type]
+        if order.endswith("desc"):
+            elements = list(reversed(elements))
+
+        page = elements[offset:offset + page_size]
+        next_offset = offset + page_size
+        cursor = f"{element_type}|{order}|{page_size}|{next_offset}" if next_offset < len(elements) else None
+        return 200, {"data": page, "next": cursor}
+
+    def create_element(self, fake: FakeBluescape, body, workspace_id):
+        element = create_element(json.loads(body))
+
+        if element["type"] == "Image" and "sourceUrl" not in element:
+            # A zygote, the image data is sent to the presigned form next
+            upload_id = uuid.uuid4().hex
+            with fake.lock:
+                fake.uploads[upload_id] = element["id"]
+            fake.add_element(workspace_id, element)
+            host = self.headers.get("Host")
+            return 200, {"data": {
+                "id": element["id"],
+                "content": {
+                    "uploadId": upload_id,
+                    "url": f"http://{host}/s3/{upload_id}",
+                    "fields": {
+                        "key": f"assets/{upload_id}",
+                        "bucket": "fake-bucket",
+                        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+                        "X-Amz-Credential": "fake",
+                        "X-Amz-Date": time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()),
+                        "Policy": "fake",
+                        "X-Amz-Signature": "fake"
+                    }
+                }
+            }}
+
+        if element["type"] == "Image":
+            element["asset"] = {"url": element["sourceUrl"]}
+        fake.add_element(workspace_id, element)
+        return 200, {"data": {"id": element["id"]}}
+
+    def get_element(self, fake: FakeBluescape, body, workspace_id, element_id):
+        element = fake.find_element(workspace_id, element_id)
+        if element is None:
+            return 404, {"message": "Element not found"}
+        return 200, {"data": element}
+
+    def delete_element(self, fake: FakeBluescape, body, workspace_id, element_id):
+        elements = fake.get_elements(workspace_id)
+        with fake.lock:
+            elements[:] = [element for element in elements if element["id"] != element_id]
+        return 204, None
+
+    def upload_asset(self, fake: FakeBluescape, body, upload_id):
+        if upload_id not in fake.uploads:
+            return 403, b"<Error><Code>AccessDenied</Code><Message>Unknown upload</Message></Error>"
+        return 204, None
+
+    def finish_asset(self, fake: FakeBluescape, body, workspace_id, upload_id):
+        with fake.lock:
+            element_id = fake.uploads.pop(upload_id, None)
+        if element_id is None:
+            return 404, {"message": "Upload not found"}
+        element = fake.find_element(workspace_id, element_id)
+        if element is not None:
+            element["asset"] = {"url": f"http://{self.headers.get('Host')}/assets/{upload_id}"}
+        return 200, {}
+
+    def get_user(self, fake: FakeBluescape, body):
+        return 200, {"id": "benchmark-user", "firstName": "Benchmark", "lastName": "User"}
+
+    def list_workspaces(self, fake: FakeBluescape, body):
+        return 200, {"workspaces": [{"id": "benchmark-workspace", "name": "Benchmark workspace"}], "next": None}
+
+    def collect(self, fake: FakeBluescape, body):
+        return 200, {}
+
+    def stats(self, fake: FakeBluescape, body):
+        return 200, fake.get_stats()
+
+    def reset(self, fake: FakeBluescape, body):
+        fake.reset()
+        return 200, {}
+
+def create_server(port = 0, latency = 0.0, bandwidth = None, num_canvases = 0, host = "127.0.0.1"):
+    """
+    :param bandwidth: Bytes per second, or None for unlimited.
+    """
+    server = ThreadingHTTPServer((host, port), FakeBluescapeHandler)
+    server.daemon_threads = True
+    server.fake = FakeBluescape(latency, bandwidth, num_canvases)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description = "Local stand-in for the Bluescape API, for benchmarks.")
+    parser.add_argument("--port", type = int, default = 0, help = "Port to listen on, 0 picks a free one")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Seconds added to every request")
+    parser.add_argument("--bandwidth", type = float, default = 0, help = "Megabytes per second for request and response bodies, 0 for unlimited")
+    parser.add_argument("--canvases", type = int, default = 0, help = "Existing canvases in each workspace")
+    args = parser.parse_args()
+
+    server = create_server(args.port, args.latency, args.bandwidth * 1024 * 1024 or None, args.canvases)
+    # The harness reads the port from the first line
+    print(f"http://127.0.0.1:{server.server_address[1]}", flush = True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
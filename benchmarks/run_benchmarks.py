@@ -0,0 +1,467 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""
+Benchmarks uploads end to end against the fake Bluescape server, by calling
+Script.postprocess with synthetic Processed objects for a range of batch sizes.
+
+Run it from the webui directory with the webui environment active, as the
+extension needs the webui modules:
+
+    python extensions/sd-webui-bluescape/benchmarks/run_benchmarks.py --save baselines/my-machine.json
+
+Relative --save and --compare paths are taken from the benchmarks directory.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from urllib.request import Request, urlopen
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+extension_dir = os.path.dirname(benchmarks_dir)
+
+default_batch_sizes = [1, 2, 4, 8, 16, 32, 64, 100]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = "Benchmarks Bluescape uploads against a local fake Bluescape server.")
+    parser.add_argument("--webui-dir", default = os.getenv("WEBUI_DIR", os.getcwd()), help = "The stable-diffusion-webui directory, defaults to the current directory")
+    parser.add_argument("--batch-sizes", default = ",".join(str(size) for size in default_batch_sizes), help = "Comma separated images per upload")
+    parser.add_argument("--repeat", type = int, default = 3, help = "Uploads per batch size, the median is reported")
+    parser.add_argument("--image-size", type = int, default = 512, help = "Width and height of the generated images")
+    parser.add_argument("--image-encoding", default = None, help = "Image encoding setting of the extension, defaults to its default")
+    parser.add_argument("--saved-images", action = "store_true", help = "Save the images as PNG files first, like the webui does, so the upload can use the files")
+    parser.add_argument("--background", action = "store_true", help = "Upload in the background, timed until the upload queue is empty")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "Seconds the fake server adds to every request")
+    parser.add_argument("--bandwidth", type = float, default = 10, help = "Megabytes per second the fake server transfers, 0 for unlimited")
+    parser.add_argument("--canvases", type = int, default = 50, help = "Canvases already in the workspace")
+    parser.add_argument("--no-memory", action = "store_true", help = "Skip the extra upload per batch size that measures peak memory, in a process of its own")
+    parser.add_argument("--save", help = "Write the results as a JSON baseline to this file")
+    parser.add_argument("--compare", help = "Compare the results with this JSON baseline, and exit with status 1 on a regression")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "Slowdown or memory growth over the baseline that counts as a regression")
+    # Used by the process that measures the memory of an upload
+    parser.add_argument("--memory-run", type = int, help = argparse.SUPPRESS)
+    parser.add_argument("--server-url", help = argparse.SUPPRESS)
+    return parser.parse_args()
+
+def get_path(path):
+    return path if os.path.isabs(path) else os.path.join(benchmarks_dir, path)
+
+class FakeServer:
+    """
+    The fake Bluescape server, in its own process so that it doesn't compete
+    with the upload for the GIL or add to the memory measurements.
+    """
+
+    def __init__(self, url, process = None):
+        self.url = url
+        self.process = process
+
+    @staticmethod
+    def start(latency, bandwidth, num_canvases):
+        command = [sys.executable, os.path.join(benchmarks_dir, "fake_bluescape.py"),
+            "--latency", str(latency), "--bandwidth", str(bandwidth), "--canvases", str(num_canvases)]
+        process = subprocess.Popen(command, stdout = subprocess.PIPE, text = True)
+        url = process.stdout.readline().strip()
+        if not url:
+            raise RuntimeError("The fake Bluescape server did not start")
+        return FakeServer(url, process)
+
+    def get_stats(self):
+        with urlopen(f"{self.url}/_stats") as response:
+            return json.load(response)
+
+    def reset(self):
+        urlopen(Request(f"{self.url}/_reset", data = b"", method = "POST")).close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+def load_script(webui_dir, data_dir):
+    """
+    Imports the extension within the webui, with its state kept in data_dir.
+
+    :return: The Script class of the extension.
+    """
+    if not os.path.isdir(os.path.join(webui_dir, "modules")):
+        raise SystemExit(f"{webui_dir} is not a stable-diffusion-webui directory, use --webui-dir")
+
+    # Keep the state of the extension, and its login, apart from the real one
+    for name in ("XDG_DATA_HOME", "APPDATA", "LOCALAPPDATA"):
+        os.environ[name] = data_dir
+    os.environ["HOME"] = data_dir
+    # The webui parses the command line on import, which has our arguments
+    os.environ["IGNORE_CMD_ARGS_ERRORS"] = "1"
+    sys.argv = sys.argv[:1]
+
+    os.chdir(webui_dir)
+    sys.path[:0] = [extension_dir, webui_dir]
+    try:
+        from modules import initialize
+        initialize.imports()
+    except ImportError:
+        # Versions before 1.6 set things up on import
+        import modules.paths
+
+    from bs.bluescape_upload import Script
+
+    state_dir = os.path.abspath(Script.manager.state.data_dir)
+    if not state_dir.startswith(os.path.abspath(data_dir)):
+        raise SystemExit(f"The extension state is in {state_dir} rather than a temporary directory, not running the benchmark against it")
+
+    return Script
+
+def create_images(num_images, size):
+    from PIL import Image
+
+    # Noise over a gradient compresses about as well as a generated image,
+    # rather than as well as a flat colour or as badly as pure noise
+    gradient = Image.linear_gradient("L").resize((size, size))
+    images = []
+    for _ in range(num_images):
+        channels = [Image.blend(gradient, Image.effect_noise((size, size), 48), 0.35) for _ in range(3)]
+        images.append(Image.merge("RGB", channels))
+    return images
+
+def create_processed(images, size):
+    """
+    :return: An object with the fields of modules.processing.Processed the extension reads.
+    """
+    num_images = len(images)
+    seeds = list(range(1000, 1000 + num_images))
+    prompt = "a benchmark of uploads to a bluescape workspace, highly detailed"
+    negative_prompt = "blurry"
+
+    return SimpleNamespace(
+        images = images,
+        index_of_first_image = 0,
+        width = size,
+        height = size,
+        prompt = prompt,
+        negative_prompt = negative_prompt,
+        all_prompts = [prompt] * num_images,
+        all_negative_prompts = [negative_prompt] * num_images,
+        seed = seeds[0],
+        subseed = -1,
+        all_seeds = seeds,
+        all_subseeds = [-1] * num_images,
+        subseed_strength = 0,
+        infotexts = [f"{prompt}\nNegative prompt: {negative_prompt}\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: {seed}, Size: {size}x{size}" for seed in seeds],
+        sampler_name = "Euler a",
+        cfg_scale = 7.0,
+        image_cfg_scale = None,
+        restore_faces = False,
+        face_restoration_model = None,
+        sd_model_hash = "0000000000",
+        seed_resize_from_w = -1,
+        seed_resize_from_h = -1,
+        denoising_strength = None,
+        extra_generation_params = {},
+        clip_skip = 1,
+        eta = None,
+        ddim_discretize = "uniform",
+        s_churn = 0.0,
+        s_tmin = 0.0,
+        s_tmax = float("inf"),
+        s_noise = 1.0,
+        sampler_noise_scheduler_override = None,
+        is_using_inpainting_conditioning = False
+    )
+
+def save_images(manager, images, directory):
+    """
+    Saves the images as PNG files, and tells the extension about them like the webui does.
+    """
+    for i, image in enumerate(images):
+        filename = os.path.join(directory, f"{i:05}.png")
+        image.save(filename, format = "PNG")
+        manager.saved_images.on_image_saved(SimpleNamespace(image = image, filename = filename))
+
+def wait_for_uploads(manager, timeout = 600):
+    deadline = time.perf_counter() + timeout
+    while manager.job_registry.active or manager.get_pending_uploads():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Background uploads did not finish in time")
+        time.sleep(0.01)
+
+def get_max_rss():
+    """
+    :return: The peak resident set size of this process so far, in bytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+def run_upload(script, server, batch_size, args, image_dir):
+    """
+    Uploads one batch of images through Script.postprocess.
+
+    :return: The measurements of the upload.
+    """
+    manager = script.manager
+    p = SimpleNamespace()
+
+    images = create_images(batch_size, args.image_size)
+    processed = create_processed(images, args.image_size)
+    if args.saved_images:
+        save_images(manager, images, image_dir)
+
+    # The webui calls process before generating, which gets the connections ready
+    script.process(p, True)
+    server.reset()
+    gc.collect()
+
+    start = time.perf_counter()
+    script.postprocess(p, processed, True)
+    if args.background:
+        wait_for_uploads(manager)
+    wall_time = time.perf_counter() - start
+
+    last_job = manager.job_registry.history[-1] if manager.job_registry.history else None
+    if last_job is None or last_job.phase != "complete":
+        raise RuntimeError(f"Upload of {batch_size} images did not complete: {last_job.to_dict() if last_job else 'no job'}")
+
+    stats = server.get_stats()
+    return {
+        "wall_time": wall_time,
+        "request_count": stats["request_count"],
+        "requests": stats["requests"],
+        "bytes_sent": stats["bytes_received"],
+        "bytes_received": stats["bytes_sent"]
+    }
+
+def setup_script(script, args):
+    manager = script.manager
+    state = manager.state
+    state.user_token = "benchmark-token"
+    state.user_id = "benchmark-user"
+    state.workspace_ids = {"benchmark-workspace": "Benchmark workspace"}
+    state.selected_workspace_id = "benchmark-workspace"
+    state.background_upload = args.background
+    # As shown by the settings of the Bluescape tab
+    state.canvas_border_color = manager.get_canvas_border_color()
+    if args.image_encoding is not None:
+        state.image_encoding = args.image_encoding
+
+    script.is_txt2img = True
+    script.is_img2img = False
+
+def get_batch_sizes(args):
+    return [int(size) for size in args.batch_sizes.split(",")]
+
+def run_benchmarks(script, server, args, peak_memories):
+    """
+    :param peak_memories: The peak memory measured for each batch size, if any.
+    """
+    setup_script(script, args)
+
+    results = []
+    with tempfile.TemporaryDirectory() as image_dir:
+        # Connections, imports and caches are set up by a first upload that isn't measured
+        run_upload(script, server, 1, args, image_dir)
+
+        for batch_size in get_batch_sizes(args):
+            runs = [run_upload(script, server, batch_size, args, image_dir) for _ in range(args.repeat)]
+            result = dict(runs[-1])
+            result["batch_size"] = batch_size
+            result["wall_time"] = statistics.median(run["wall_time"] for run in runs)
+            result["wall_times"] = [run["wall_time"] for run in runs]
+            result["images_per_second"] = batch_size / result["wall_time"]
+
+            result["peak_memory"] = peak_memories.get(batch_size)
+
+            results.append(result)
+            print(format_result(result), flush = True)
+
+    return results
+
+def measure_memory(memory_command, batch_size):
+    """
+    Measures the memory of an upload in a process of its own, as the peak resident set size
+    is the highest it has been over the life of the process. Unlike tracemalloc this includes
+    the pixel and encoder buffers of Pillow.
+
+    :return: How much the upload, with the images of the batch, raised the peak resident set size, in bytes.
+    """
+    output = subprocess.run(memory_command + ["--memory-run", str(batch_size)], stdout = subprocess.PIPE, text = True, check = True).stdout
+    for line in reversed(output.splitlines()):
+        if line.startswith("peak_memory "):
+            return int(line.split()[1])
+    raise RuntimeError(f"The memory of the upload of {batch_size} images was not measured")
+
+def run_memory_upload(script, server, args):
+    """
+    Uploads one batch in this process, for measure_memory.
+    """
+    setup_script(script, args)
+    batch_size = args.memory_run
+
+    with tempfile.TemporaryDirectory() as image_dir:
+        # Imports and caches are set up by a first upload that isn't measured
+        run_upload(script, server, 1, args, image_dir)
+        gc.collect()
+
+        # Freed memory is reused by the next allocations without raising the peak, so
+        # the images of the batch are created after this, or the upload could fit in
+        # the space they left behind
+        max_rss = get_max_rss()
+        run_upload(script, server, batch_size, args, image_dir)
+        print(f"peak_memory {get_max_rss() - max_rss}", flush = True)
+
+def format_result(result):
+    peak_memory = f"{result['peak_memory'] / 1024 / 1024:8.1f} MB" if result.get("peak_memory") is not None else "       -   "
+    return (f"{result['batch_size']:5} images  {result['wall_time']:8.2f} s  {result['images_per_second']:6.2f} images/s  "
+        f"{result['request_count']:5} requests  {result['bytes_sent'] / 1024 / 1024:8.1f} MB sent  {peak_memory} peak")
+
+def get_settings(args, script):
+    return {
+        "batch_sizes": args.batch_sizes,
+        "repeat": args.repeat,
+        "image_size": args.image_size,
+        "image_encoding": script.manager.state.image_encoding,
+        "saved_images": args.saved_images,
+        "background": args.background,
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+        "canvases": args.canvases
+    }
+
+def compare(baseline, results, tolerance):
+    """
+    :return: The regressions against the baseline, as messages.
+    """
+    regressions = []
+    baseline_results = {result["batch_size"]: result for result in baseline["results"]}
+
+    for result in results:
+        batch_size = result["batch_size"]
+        before = baseline_results.get(batch_size)
+        if before is None:
+            continue
+
+        if result["wall_time"] > before["wall_time"] * (1 + tolerance):
+            regressions.append(f"{batch_size} images: {result['wall_time']:.2f} s, was {before['wall_time']:.2f} s")
+        if result["request_count"] > before["request_count"]:
+            regressions.append(f"{batch_size} images: {result['request_count']} requests, was {before['request_count']}")
+        if result.get("peak_memory") and before.get("peak_memory") and result["peak_memory"] > before["peak_memory"] * (1 + tolerance):
+            regressions.append(f"{batch_size} images: {result['peak_memory'] / 1024 / 1024:.1f} MB peak memory, was {before['peak_memory'] / 1024 / 1024:.1f} MB")
+
+    return regressions
+
+def main():
+    # load_script clears the command line, the memory runs get the same one
+    argv = sys.argv[1:]
+    args = parse_args()
+    webui_dir = os.path.abspath(args.webui_dir)
+
+    if args.memory_run is not None:
+        server = FakeServer(args.server_url)
+    else:
+        server = FakeServer.start(args.latency, args.bandwidth, args.canvases)
+    os.environ["BS_API_BASE_DOMAIN"] = server.url
+    os.environ["BS_ANALYTICS_BASE_DOMAIN"] = server.url
+    os.environ["BS_ISAM_BASE_DOMAIN"] = server.url
+    os.environ["BS_CLIENT_BASE_DOMAIN"] = server.url
+
+    peak_memories = {}
+    if args.memory_run is None and not args.no_memory:
+        if resource is None:
+            print("Peak memory can't be measured on this platform, skipping it")
+        else:
+            # Measured before this process loads the webui or uploads anything, as a new
+            # process starts out with the peak resident set size of the one that started it
+            print("Measuring peak memory...", flush = True)
+            memory_command = [sys.executable, os.path.join(benchmarks_dir, os.path.basename(__file__)), *argv, "--webui-dir", webui_dir, "--server-url", server.url]
+            try:
+                for batch_size in get_batch_sizes(args):
+                    peak_memories[batch_size] = measure_memory(memory_command, batch_size)
+            except BaseException:
+                server.stop()
+                raise
+
+    data_dir = tempfile.mkdtemp(prefix = "bluescape-benchmark-")
+    try:
+        script = load_script(webui_dir, data_dir)()
+        # Set by the webui when it loads the script, title() reads the extension version with it
+        script.filename = os.path.join(extension_dir, "scripts", "bluescape_upload.py")
+        script.title()
+
+        if args.memory_run is not None:
+            run_memory_upload(script, server, args)
+            return
+
+        print(f"Benchmarking uploads against {server.url} ({args.latency * 1000:.0f} ms latency, {args.bandwidth or 'unlimited'} MB/s)")
+        results = run_benchmarks(script, server, args, peak_memories)
+        settings = get_settings(args, script)
+        extension_version = script.manager.state.extension_version.strip()
+    finally:
+        server.stop()
+        shutil.rmtree(data_dir, ignore_errors = True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "extension_version": extension_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "results": results
+    }
+
+    if args.save:
+        path = get_path(args.save)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent = 2)
+        print(f"Results saved to {path}")
+
+    if args.compare:
+        with open(get_path(args.compare)) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print("Warning: the baseline was measured with different settings")
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -23,8 +23,9 @@
 #
 from datetime import datetime
 from .state_manager import StateManager
-import requests
 from .config import Config
+from .http_client import http_client
+from .metrics import instrumented
 
 class AnalyticsEvent:
     componentId = str
@@ -102,6 +103,7 @@ class Analytics:
 
     # Private
 
+    @instrumented("analytics_send_event")
     def send_event(self, e: AnalyticsEvent, token):
 
         if self.state.enable_analytics:
@@ -123,7 +125,7 @@ class Analytics:
                 body['events'][0]['workspaceId'] = e.workspaceId
 
             url = f'{Config.analytics_base_domain}/api/v3/collect'
-            response = requests.post(url, json = body, headers = self.get_headers(token))
+            response = http_client.post(url, json = body, headers = self.get_headers(token))
             if response.status_code != 200:
                 print("Analytics response: " + str(response.text))
 
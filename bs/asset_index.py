@@ -0,0 +1,123 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import hashlib
+import os
+import threading
+import time
+from .database import connect
+from .element_listing import parse_element_listing
+
+content_hash_trait = "http://bluescape.dev/automatic1111-extension/v1/contentHash"
+
+def parse_image_hashes(stream):
+    """
+    Parses an image element listing as it is read from the stream, picking out
+    just the element ids and content hash traits.
+
+    :return: (element id, content hash) pairs of the images that have a content hash, and the
+    cursor of the next page, if any.
+    """
+    content_hash_prefix = "data.item.traits.content." + content_hash_trait
+
+    def from_element(element):
+        content = (element.get("traits") or {}).get("content") or {}
+        return [element.get("id"), content.get(content_hash_trait)]
+
+    def on_image_event(image, prefix, event, value):
+        if prefix == "data.item.id":
+            image[0] = value
+        elif prefix == content_hash_prefix and event == "string":
+            image[1] = value
+
+    images, cursor = parse_element_listing(stream, from_element, lambda: [None, None], on_image_event)
+    return [(element_id, content_hash) for element_id, content_hash in images if content_hash], cursor
+
+def get_content_hash(image):
+    """
+    Hash of the pixels of the image, so the same image hashes the same
+    regardless of how it was (or will be) encoded.
+    """
+    sha = hashlib.sha256()
+    sha.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+class AssetIndex:
+    """
+    Local index of images already uploaded to a workspace, by content hash.
+    Used to avoid uploading the same source image or mask again and again
+    when iterating in img2img.
+    """
+
+    def __init__(self, data_dir):
+        self.db_file = os.path.join(data_dir, "asset_index.db")
+        self.lock = threading.Lock()
+
+        with connect(self.db_file) as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS assets (
+                    workspace_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    element_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (workspace_id, content_hash)
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS scanned_workspaces (
+                    workspace_id TEXT PRIMARY KEY,
+                    scanned_at REAL NOT NULL
+                )
+            """)
+
+    def get(self, workspace_id, content_hash):
+        with self.lock, connect(self.db_file) as db:
+            row = db.execute("SELECT element_id FROM assets WHERE workspace_id = ? AND content_hash = ?", (workspace_id, content_hash)).fetchone()
+        return row[0] if row else None
+
+    def add(self, workspace_id, content_hash, element_id):
+        with self.lock, connect(self.db_file) as db:
+            db.execute("INSERT OR REPLACE INTO assets (workspace_id, content_hash, element_id, created_at) VALUES (?, ?, ?, ?)", (workspace_id, content_hash, element_id, time.time()))
+
+    def remove(self, workspace_id, content_hash):
+        with self.lock, connect(self.db_file) as db:
+            db.execute("DELETE FROM assets WHERE workspace_id = ? AND content_hash = ?", (workspace_id, content_hash))
+
+    def is_scanned(self, workspace_id):
+        with self.lock, connect(self.db_file) as db:
+            row = db.execute("SELECT 1 FROM scanned_workspaces WHERE workspace_id = ?", (workspace_id,)).fetchone()
+        return row is not None
+
+    def add_scanned(self, workspace_id, image_hashes):
+        """
+        Rebuilds the index of a workspace from the content hash traits stored on its image
+        elements. This way the index survives a cleared local cache.
+
+        :param image_hashes: (element id, content hash) pairs of all image elements of the workspace.
+        """
+        with self.lock, connect(self.db_file) as db:
+            for element_id, content_hash in image_hashes:
+                if content_hash and element_id:
+                    db.execute("INSERT OR IGNORE INTO assets (workspace_id, content_hash, element_id, created_at) VALUES (?, ?, ?, ?)", (workspace_id, content_hash, element_id, time.time()))
+            db.execute("INSERT OR REPLACE INTO scanned_workspaces (workspace_id, scanned_at) VALUES (?, ?)", (workspace_id, time.time()))
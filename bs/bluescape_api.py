@@ -25,13 +25,23 @@ import re
 
 from bs.misc import hex_to_bluescape_rgb
 from .expired_token_exception import ExpiredTokenException
+from .bluescape_api_exception import BluescapeApiException
+from .expired_upload_exception import ExpiredUploadException
+from .asset_index import parse_image_hashes
+from .canvas_cache import parse_canvas_summaries
 from .config import Config
+from .http_client import http_client
+from .metrics import instrumented
+from . import tracing
+from .multipart_stream import MultipartStream
 from typing import Tuple
-import requests
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 import json
 
 default_timeout = 30
 
+@instrumented()
 def bs_find_space(token, workspace_id, bounding_box: Tuple[int, int, int, int], direction) -> Tuple[int, int, int, int]:
 
     x, y, width, height = bounding_box
@@ -48,7 +58,8 @@ def bs_find_space(token, workspace_id, bounding_box: Tuple[int, int, int, int],
         }
     }
 
-    response = requests.post(bs_api_url, json = body, headers = get_headers(token), timeout = default_timeout)
+    # Only looks for space, nothing is created, so it is safe to retry
+    response = http_client.post(bs_api_url, json = body, headers = get_headers(token), timeout = default_timeout, idempotent = True)
 
     if response.status_code == 200:
 
@@ -60,29 +71,123 @@ def bs_find_space(token, workspace_id, bounding_box: Tuple[int, int, int, int],
 
             return (x, y, width, height)
 
-    elif response.status_code == 401:
-        raise ExpiredTokenException
+    check_response(response)
 
-def bs_get_existing_canvases(token, workspace_id):
+@instrumented()
+def bs_get_canvas_summaries(token, workspace_id, cursor = None):
+    """
+    Gets a page of the canvases of the workspace as compact summaries, parsing the
+    listing as it streams in rather than loading it into memory first.
 
-    bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements?type=Canvas'
+    :return: The canvas summaries and the cursor of the next page.
+    """
 
-    response = requests.get(bs_api_url, headers = get_headers(token), timeout = default_timeout)
+    bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements?type=Canvas&pageSize={Config.canvas_page_size}'
 
-    if response.status_code == 200:
-        result = response.json()
-        return result["data"]
+    ordered = cursor is None and bool(Config.canvas_listing_order)
+    if ordered:
+        bs_api_url = f'{bs_api_url}&orderBy={Config.canvas_listing_order}'
 
-    elif response.status_code == 401:
-        raise ExpiredTokenException
+    if cursor is not None:
+        bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements?cursor={cursor}'
+
+    response = http_client.get(bs_api_url, headers = get_headers(token), timeout = default_timeout, stream = True)
+
+    with response:
+        if response.status_code == 200:
+            return parse_streamed_response(response, parse_canvas_summaries)
+
+        if ordered and response.status_code in (400, 422):
+            # The server doesn't support ordering the listing, so list the canvases
+            # unordered from now on, which means always listing all of them
+            print(f"Canvas listing order '{Config.canvas_listing_order}' was rejected ({response.status_code}), listing unordered")
+            Config.canvas_listing_order = ''
+            return bs_get_canvas_summaries(token, workspace_id)
+
+        check_response(response)
+
+@instrumented()
+def bs_get_existing_images(token, workspace_id, cursor = None):
+    """
+    Gets a page of the content hashes of the images in the workspace, parsing the
+    listing as it streams in rather than loading it into memory first.
+
+    :return: (element id, content hash) pairs and the cursor of the next page.
+    """
+
+    bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements?type=Image&pageSize={Config.image_page_size}'
+
+    if cursor is not None:
+        bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements?cursor={cursor}'
+
+    response = http_client.get(bs_api_url, headers = get_headers(token), timeout = default_timeout, stream = True)
+
+    with response:
+        check_response(response)
+        return parse_streamed_response(response, parse_image_hashes)
+
+@instrumented()
+def bs_get_element(token, workspace_id, element_id):
+
+    bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements/{element_id}'
+
+    response = http_client.get(bs_api_url, headers = get_headers(token), timeout = default_timeout)
+    check_response(response)
+
+    return response.json()["data"]
 
-def bs_create_zygote_at(token, workspace_id, filename, x, y, width, height, traits):
+@instrumented()
+def bs_copy_image_at(token, workspace_id, element_id, filename, bounding_box: Tuple[int, int, int, int], traits):
+    """
+    Creates a new image element from the asset of an existing image element in the
+    workspace, so the image data doesn't have to be uploaded again.
+
+    :return: The id of the new image element.
+    """
+
+    x, y, width, height = bounding_box
+
+    element = bs_get_element(token, workspace_id, element_id)
+    asset_url = (element.get('asset') or {}).get('url')
+    if not asset_url:
+        raise BluescapeApiException(404, f"Image element {element_id} has no asset to copy")
+
+    body = {
+        'type': 'Image',
+        'sourceUrl': asset_url,
+        'title': filename,
+        'filename': filename,
+        'width': width,
+        'height': height,
+        'transform': {
+            'x': x,
+            'y': y
+        },
+        'traits': {
+            'content': {
+
+            }
+        }
+    }
+
+    for k, v in traits.items():
+        body['traits']['content'][k] = v
+
+    url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements'
+
+    response = http_client.post(url, json = body, headers = get_headers(token), timeout = default_timeout)
+    check_response(response)
+
+    return response.json()['data']['id']
+
+@instrumented()
+def bs_create_zygote_at(token, workspace_id, filename, x, y, width, height, traits, image_format = 'png'):
 
     bs_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements'
 
     body =  {
         'type': 'Image',
-        'imageFormat': 'png',
+        'imageFormat': image_format,
         'title': filename,
         'filename': filename,
         'width': width,
@@ -101,10 +206,12 @@ def bs_create_zygote_at(token, workspace_id, filename, x, y, width, height, trai
     for k, v in traits.items():
         body['traits']['content'][k] = v
 
-    response = requests.post(bs_api_url, json = body, headers = get_headers(token), timeout = default_timeout)
+    response = http_client.post(bs_api_url, json = body, headers = get_headers(token), timeout = default_timeout)
+    check_response(response)
 
     return response.text
 
+@instrumented()
 def bs_upload_asset(zr, buffer):
 
     body =  {
@@ -117,28 +224,157 @@ def bs_upload_asset(zr, buffer):
         'X-Amz-Signature': zr['data']['content']['fields']['X-Amz-Signature'],
     }
 
-    files = { 'file': buffer}
+    # The image is streamed from the buffer (or file) as is, rather than
+    # copied into a multipart body in memory first
+    stream = MultipartStream(body, 'file', 'file', buffer)
+    data = stream.chunked() if Config.chunked_uploads else stream
 
     url = zr['data']['content']['url']
-    response = requests.post(url, data = body, files = files, timeout = default_timeout)
+    # Uploading to the same key again just overwrites it, so it is safe to retry
+    response = http_client.post(url, data = data, headers = { 'Content-Type': stream.content_type }, timeout = default_timeout, idempotent = True)
+
+    if response.status_code in (400, 403) and "expired" in response.text.lower():
+        raise ExpiredUploadException(response.status_code, response.text)
+    check_response(response)
 
     return response.text
 
+@instrumented()
 def bs_finish_asset(token, workspace_id, upload_id):
 
     bs_elementary_api_url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/assets/uploads/{upload_id}'
 
-    requests.put(bs_elementary_api_url, headers = get_headers(token), json = {}, timeout = default_timeout)
+    response = http_client.put(bs_elementary_api_url, headers = get_headers(token), json = {}, timeout = default_timeout)
+    check_response(response)
 
-def bs_upload_image_at(token, workspace_id, buffer, filename, bounding_box: Tuple[int, int, int, int], traits):
+@instrumented()
+def bs_delete_element(token, workspace_id, element_id):
+
+    url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements/{element_id}'
+
+    response = http_client.request("DELETE", url, headers = get_headers(token), timeout = default_timeout)
+    check_response(response)
+
+def delete_zygote(token, workspace_id, zygote, filename):
+    try:
+        bs_delete_element(token, workspace_id, zygote['data']['id'])
+    except Exception as e:
+        print(f"Failed to remove image element for {filename}: {e}")
+
+@tracing.traced()
+def bs_upload_image_at(token, workspace_id, buffer, filename, bounding_box: Tuple[int, int, int, int], traits, image_format = 'png'):
 
     x, y, width, height = bounding_box
 
-    zygote_response = bs_create_zygote_at(token, workspace_id, filename, x, y, width,height, traits)
+    zygote_response = bs_create_zygote_at(token, workspace_id, filename, x, y, width,height, traits, image_format)
     zygote = json.loads(zygote_response)
-    bs_upload_asset(zygote, buffer)
-    bs_finish_asset(token, workspace_id, zygote['data']['content']['uploadId'])
 
+    try:
+        with open_buffer(buffer) as data:
+            # File backed data has been read to the end by a failed upload, so remember where it starts
+            data_start = data.tell() if hasattr(data, "seek") else None
+            try:
+                bs_upload_asset(zygote, data)
+            except ExpiredUploadException:
+                # The presigned fields are only valid for a limited time, which may have passed
+                # if we were retrying for a while. Start over with a fresh zygote.
+                print(f"Upload fields for {filename} have expired, requesting new ones")
+                delete_zygote(token, workspace_id, zygote, filename)
+                zygote = None
+                zygote = json.loads(bs_create_zygote_at(token, workspace_id, filename, x, y, width, height, traits, image_format))
+                if data_start is not None:
+                    data.seek(data_start)
+                bs_upload_asset(zygote, data)
+
+        bs_finish_asset(token, workspace_id, zygote['data']['content']['uploadId'])
+    except Exception:
+        # Otherwise the zygote stays in the workspace as a broken image, next to
+        # the one a retry of the upload creates
+        if zygote is not None:
+            delete_zygote(token, workspace_id, zygote, filename)
+        raise
+
+    return zygote['data'].get('id')
+
+@tracing.traced()
+def bs_upload_images_at(token, workspace_id, uploads, max_workers = Config.upload_workers, on_uploaded = None, image_format = 'png', on_failed = None):
+    """
+    Uploads several images at once. Each image still goes through the zygote,
+    S3 and finish steps in order, but up to max_workers images are in flight
+    at the same time.
+
+    :param uploads: A list or generator of (buffer, filename, bounding_box, traits) tuples.
+    Items are only taken from it once a worker is free, so a generator can produce the
+    images just in time. See open_buffer for what the buffer can be.
+    :param on_uploaded: Optional callback, called with the index and element id of each image as it completes.
+    If an upload fails no more are started, but the ones in flight are still reported before the error is raised.
+    :param on_failed: Optional callback, called with the index and exception of each image that failed to upload.
+    Only the first exception is raised.
+    :return: A list of image element ids, in the same order as uploads.
+    """
+
+    uploads = iter(uploads)
+    results = {}
+    in_flight = {}
+    submitted = 0
+    error = None
+
+    with ThreadPoolExecutor(max_workers = max(1, max_workers)) as executor:
+
+        def submit_next():
+            nonlocal submitted
+            if error is not None:
+                return False
+            upload = next(uploads, None)
+            if upload is None:
+                return False
+
+            buffer, filename, bounding_box, traits = upload
+            in_flight[executor.submit(tracing.propagate(bs_upload_image_at), token, workspace_id, buffer, filename, bounding_box, traits, image_format)] = submitted
+            submitted += 1
+            return True
+
+        while len(in_flight) < max_workers and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when = FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    # Let the other uploads finish, so they are recorded as done
+                    error = error or e
+                    if on_failed is not None:
+                        on_failed(index, e)
+                    continue
+                if on_uploaded is not None:
+                    on_uploaded(index, results[index])
+                submit_next()
+
+    if error is not None:
+        raise error
+
+    return [results[index] for index in range(submitted)]
+
+@contextmanager
+def open_buffer(buffer):
+    """
+    The image data to upload can be given as bytes (or any bytes-like object or
+    binary file), as a function returning them, or as a context manager producing
+    them. The latter lets the caller produce the data just in time and release it
+    as soon as the upload is done.
+    """
+    if hasattr(buffer, '__enter__'):
+        with buffer as data:
+            yield data
+    elif callable(buffer):
+        yield buffer()
+    else:
+        yield buffer
+
+@instrumented()
 def bs_create_canvas_at(token, workspace_id, title, bounding_box: Tuple[int, int, int, int], traits, canvas_color):
 
     x, y, width, height = bounding_box
@@ -176,22 +412,74 @@ def bs_create_canvas_at(token, workspace_id, title, bounding_box: Tuple[int, int
 
     url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements'
 
-    response = requests.post(url, json = body, headers = get_headers(token), timeout = default_timeout)
+    response = http_client.post(url, json = body, headers = get_headers(token), timeout = default_timeout)
+    check_response(response)
 
     response_info = json.loads(response.text)
 
     return response_info['data']['id']
 
+@instrumented()
 def bs_create_text_with_body(token, workspace_id, body):
 
     url = f'{Config.api_base_domain}/v3/workspaces/{workspace_id}/elements'
 
-    response = requests.post(url, json = body, headers = get_headers(token), timeout = default_timeout)
+    response = http_client.post(url, json = body, headers = get_headers(token), timeout = default_timeout)
+    check_response(response)
     response_info = json.loads(response.text)
 
     return response_info['data']['id']
 
-def bs_create_top_title(token, workspace_id, location: Tuple[int, int, int], text, header):
+@tracing.traced()
+def bs_create_texts_with_bodies(token, workspace_id, bodies, max_workers = Config.element_workers, on_created = None, on_failed = None):
+    """
+    Creates several text elements at once. The v3 REST API has no bulk endpoint
+    for element creation, so the elements are posted concurrently instead.
+
+    :param bodies: A list of element bodies, as returned by the *_body functions.
+    :param on_created: Optional callback, called with the index and element id of each element as it is created.
+    If a post fails the ones not started yet are cancelled, but the ones in flight are still reported before the
+    error is raised.
+    :param on_failed: Optional callback, called with the index and exception of each element that failed to be
+    created. Only the first exception is raised.
+    :return: A list of element ids, in the same order as bodies.
+    """
+
+    results = [None] * len(bodies)
+    error = None
+
+    if not bodies:
+        return results
+
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(bodies)))) as executor:
+        futures = {
+            executor.submit(tracing.propagate(bs_create_text_with_body), token, workspace_id, body): index
+            for index, body in enumerate(bodies)
+        }
+
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                if error is None:
+                    error = e
+                    for other in futures:
+                        other.cancel()
+                if on_failed is not None:
+                    on_failed(index, e)
+                continue
+            if on_created is not None:
+                on_created(index, results[index])
+
+    if error is not None:
+        raise error
+
+    return results
+
+def top_title_body(location: Tuple[int, int, int], text, header):
 
     title = "  |  " + text
 
@@ -243,9 +531,9 @@ def bs_create_top_title(token, workspace_id, location: Tuple[int, int, int], tex
         }
     }
 
-    return bs_create_text_with_body(token, workspace_id, body)
+    return body
 
-def bs_create_extended_data(token, workspace_id, location: Tuple[int, int, int], extended_generation_data):
+def extended_data_body(location: Tuple[int, int, int], extended_generation_data):
 
     content = []
     for key_value_pair in extended_generation_data:
@@ -300,9 +588,9 @@ def bs_create_extended_data(token, workspace_id, location: Tuple[int, int, int],
         }
     }
 
-    return bs_create_text_with_body(token, workspace_id, body)
+    return body
 
-def bs_create_generation_data(token, workspace_id, location: Tuple[int, int, int], infotext):
+def generation_data_body(location: Tuple[int, int, int], infotext):
 
     infos = infotext.split("\n")
 
@@ -435,9 +723,9 @@ def bs_create_generation_data(token, workspace_id, location: Tuple[int, int, int
         }
     }
 
-    return bs_create_text_with_body(token, workspace_id, body)
+    return body
 
-def bs_create_seed(token, workspace_id, location: Tuple[int, int, int], seed, subseed):
+def seed_body(location: Tuple[int, int, int], seed, subseed):
 
     body = {
         "type": "Text",
@@ -490,11 +778,9 @@ def bs_create_seed(token, workspace_id, location: Tuple[int, int, int], seed, su
         }
     }
 
-    return bs_create_text_with_body(token, workspace_id, body)
-
+    return body
 
-
-def bs_create_generation_label(token, workspace_id, location: Tuple[int, int, int], text):
+def generation_label_body(location: Tuple[int, int, int], text):
 
     body = {
         "type": "Text",
@@ -536,10 +822,9 @@ def bs_create_generation_label(token, workspace_id, location: Tuple[int, int, in
         }
     }
 
-    return bs_create_text_with_body(token, workspace_id, body)
-
+    return body
 
-def bs_create_label(token, workspace_id, location: Tuple[int, int, int], text):
+def label_body(location: Tuple[int, int, int], text):
 
     body = {
         "type": "Text",
@@ -581,42 +866,62 @@ def bs_create_label(token, workspace_id, location: Tuple[int, int, int], text):
         }
     }
 
-    return bs_create_text_with_body(token, workspace_id, body)
+    return body
 
-def bs_get_all_workspaces(token):
-    has_next_page = True
-    cursor = None
-    workspaces = []
-    i = 1
-
-    while has_next_page:
-        (current_page, next) = bs_get_workspaces(token, cursor)
-        workspaces = workspaces + current_page
-        cursor = next
-        # Limit for 3 requests for now
-        print(f"Loading workspaces... {str(i)} of 3")
-        i = i + 1
-        has_next_page = next is not None and i < 4
-
-    return workspaces
-
-def bs_get_workspaces(token, cursor = None):
+@instrumented()
+def bs_get_workspaces(token, cursor = None, etag = None):
+    """
+    :param etag: ETag of an earlier response for the first page, to only get the page if it changed.
+    :return: The workspaces, the cursor of the next page and the ETag of the response.
+    The workspaces are None if the page hasn't changed.
+    """
     url = f'{Config.api_base_domain}/v3/users/me/workspaces?pageSize=100&includeCount=true&filterBy=associatedWorkspaces eq false&orderBy=contentUpdatedAt desc'
 
     if (cursor is not None):
         url = f'{Config.api_base_domain}/v3/users/me/workspaces?cursor={cursor}'
 
-    response = requests.get(url, headers = get_headers(token), timeout = default_timeout)
+    headers = get_headers(token)
+    if etag is not None:
+        headers['If-None-Match'] = etag
+
+    response = http_client.get(url, headers = headers, timeout = default_timeout)
     if response.status_code == 200:
         response_info = json.loads(response.text)
-        return (response_info['workspaces'], response_info['next'])
+        return (response_info['workspaces'], response_info['next'], response.headers.get('ETag'))
+    elif response.status_code == 304:
+        return (None, None, etag)
     elif response.status_code == 401:
         raise ExpiredTokenException
 
+@instrumented()
+def bs_search_workspaces(token, query, page_size = 20):
+    """
+    Searches the workspaces of the user by name.
+
+    :return: The matching workspaces, or an empty list if the search failed.
+    """
+    url = f'{Config.api_base_domain}/v3/users/me/workspaces'
+    name_filter = query.replace("'", "''")
+    params = {
+        'pageSize': page_size,
+        'filterBy': f"name like '%{name_filter}%'",
+        'orderBy': 'contentUpdatedAt desc'
+    }
+
+    response = http_client.get(url, params = params, headers = get_headers(token), timeout = default_timeout)
+    if response.status_code == 200:
+        return json.loads(response.text)['workspaces']
+    elif response.status_code == 401:
+        raise ExpiredTokenException
+
+    print(f"Workspace search failed: {response.status_code}")
+    return []
+
+@instrumented()
 def bs_get_user_info(token):
         url = f'{Config.api_base_domain}/v3/users/me'
 
-        response = requests.get(url, headers = get_headers(token))
+        response = http_client.get(url, headers = get_headers(token))
 
         if response.status_code == 200:
             response_info = json.loads(response.text)
@@ -624,8 +929,22 @@ def bs_get_user_info(token):
 
         print("Error: " + response.text)
 
+def check_response(response):
+    if response.status_code == 401:
+        raise ExpiredTokenException
+    if not response.ok:
+        raise BluescapeApiException(response.status_code, response.text)
+
 def get_headers(token):
     return {
         'Authorization': f'Bearer {token}',
         'Content-type': 'application/json'
     }
+
+def parse_streamed_response(response, parse):
+    """
+    Parses the body of a response requested with stream = True as it is read.
+    """
+    # Let urllib3 take care of any content encoding while we read
+    response.raw.decode_content = True
+    return parse(response.raw)
@@ -0,0 +1,224 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import threading
+import time
+from typing import Tuple
+from .config import Config
+from .element_listing import parse_element_listing
+from .occupancy_grid import OccupancyGrid
+
+extension_enabled_trait = "http://bluescape.dev/automatic1111-extension/v1/enabled"
+user_id_trait = "http://bluescape.dev/automatic1111-extension/v1/userId"
+
+def find_values(json_input, keys, found = None):
+    """
+    Collects the first value found for each of the keys, searching nested dicts and lists.
+    """
+    if found is None:
+        found = {}
+
+    if isinstance(json_input, dict):
+        for key in keys:
+            if key in json_input and key not in found:
+                found[key] = json_input[key]
+        for v in json_input.values():
+            if len(found) == len(keys):
+                break
+            find_values(v, keys, found)
+    elif isinstance(json_input, list):
+        for item in json_input:
+            if len(found) == len(keys):
+                break
+            find_values(item, keys, found)
+
+    return found
+
+class CanvasSummary:
+    """
+    The parts of a Canvas element needed for placing new canvases.
+    """
+
+    __slots__ = ("id", "x", "y", "width", "height", "is_extension", "user_id")
+
+    def __init__(self, id, x, y, width, height, is_extension, user_id):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.is_extension = is_extension
+        self.user_id = user_id
+
+    @staticmethod
+    def from_element(element):
+        transform = element.get("transform") or {}
+        style = element.get("style") or {}
+        traits = find_values(element.get("traits"), (extension_enabled_trait, user_id_trait))
+        user_id = traits.get(user_id_trait)
+
+        return CanvasSummary(
+            element.get("id"),
+            transform.get("x", 0),
+            transform.get("y", 0),
+            style.get("width", 0),
+            style.get("height", 0),
+            extension_enabled_trait in traits,
+            str(user_id) if user_id is not None else None
+        )
+
+def parse_canvas_summaries(stream):
+    """
+    Parses an element listing into canvas summaries as it is read from the stream,
+    picking out just the fields placement needs.
+
+    :return: The canvas summaries and the cursor of the next page, if any.
+    """
+    user_id_suffix = "." + user_id_trait
+
+    def new_canvas():
+        return CanvasSummary(None, 0, 0, 0, 0, False, None)
+
+    def on_canvas_event(canvas, prefix, event, value):
+        if prefix == "data.item.id":
+            canvas.id = value
+        elif prefix == "data.item.transform.x":
+            canvas.x = value
+        elif prefix == "data.item.transform.y":
+            canvas.y = value
+        elif prefix == "data.item.style.width":
+            canvas.width = value
+        elif prefix == "data.item.style.height":
+            canvas.height = value
+        elif prefix.startswith("data.item.traits"):
+            if event == "map_key" and value == extension_enabled_trait:
+                canvas.is_extension = True
+            elif event in ("string", "number") and prefix.endswith(user_id_suffix) and canvas.user_id is None:
+                canvas.user_id = str(value)
+
+    return parse_element_listing(stream, CanvasSummary.from_element, new_canvas, on_canvas_event)
+
+class WorkspaceCanvases:
+    """
+    Canvases of one workspace, indexed by what placement asks for: the
+    latest extension canvas overall, the latest one of each user and the
+    areas the canvases occupy.
+    """
+
+    def __init__(self, canvases, loaded_at):
+        self.loaded_at = loaded_at
+        # Cursor of the next page to load, and whether all pages have been loaded
+        self.cursor = None
+        self.complete = False
+        self.canvases = []
+        self.latest_canvas = None
+        self.latest_user_canvases = {}
+        self.occupancy = OccupancyGrid()
+
+        for canvas in canvases:
+            self.add(canvas)
+
+    def add(self, canvas: CanvasSummary):
+        self.canvases.append(canvas)
+        self.occupancy.add((canvas.x, canvas.y, canvas.width, canvas.height))
+
+        # Like before, the latest canvas is the one with the highest id
+        if not canvas.is_extension or not canvas.id:
+            return
+
+        if self.latest_canvas is None or canvas.id > self.latest_canvas.id:
+            self.latest_canvas = canvas
+
+        if canvas.user_id is not None:
+            latest_user_canvas = self.latest_user_canvases.get(canvas.user_id)
+            if latest_user_canvas is None or canvas.id > latest_user_canvas.id:
+                self.latest_user_canvases[canvas.user_id] = canvas
+
+    def get_canvas_count(self):
+        return len(self.canvases)
+
+    def get_latest_canvas(self, user_id = None):
+        """
+        :param user_id: Only consider the canvases created by this user.
+        :return: The latest canvas created with the extension, or None.
+        """
+        if user_id is None:
+            return self.latest_canvas
+
+        return self.latest_user_canvases.get(str(user_id))
+
+class CanvasCache:
+    """
+    Per workspace cache of canvas summaries, so placing a canvas doesn't need to
+    download and scan every canvas in the workspace on every upload. The cache is
+    reloaded after a TTL and kept up to date with the canvases we create in between.
+    Pages are only loaded for as long as the caller needs more of them.
+    """
+
+    def __init__(self, ttl = None):
+        self.ttl = Config.canvas_cache_ttl if ttl is None else ttl
+        self.workspaces = {}
+        self.lock = threading.Lock()
+
+    def get(self, workspace_id, load_page, is_enough = None) -> WorkspaceCanvases:
+        """
+        :param load_page: Called with a cursor (None for the first page) to get a page of canvas summaries
+        and the cursor of the next page. Errors are raised to the caller, and a failed listing isn't cached.
+        :param is_enough: Called with the WorkspaceCanvases loaded so far, returns True when no more pages are needed.
+        By default all pages are loaded.
+        """
+        with self.lock:
+            workspace_canvases = self.workspaces.get(workspace_id)
+
+        if workspace_canvases is None or time.time() - workspace_canvases.loaded_at >= self.ttl:
+            workspace_canvases = WorkspaceCanvases([], time.time())
+
+        while not workspace_canvases.complete and not (is_enough is not None and is_enough(workspace_canvases)):
+            canvases, cursor = load_page(workspace_canvases.cursor)
+            with self.lock:
+                for canvas in canvases:
+                    workspace_canvases.add(canvas)
+            workspace_canvases.cursor = cursor
+            workspace_canvases.complete = cursor is None
+
+        with self.lock:
+            self.workspaces[workspace_id] = workspace_canvases
+
+        return workspace_canvases
+
+    def add_canvas(self, workspace_id, canvas_id, bounding_box: Tuple[int, int, int, int], traits):
+        x, y, width, height = bounding_box
+        user_id = traits.get(user_id_trait)
+        canvas = CanvasSummary(canvas_id, x, y, width, height, extension_enabled_trait in traits, str(user_id) if user_id is not None else None)
+
+        with self.lock:
+            workspace_canvases = self.workspaces.get(workspace_id)
+            if workspace_canvases is not None:
+                workspace_canvases.add(canvas)
+
+    def invalidate(self, workspace_id = None):
+        with self.lock:
+            if workspace_id is None:
+                self.workspaces.clear()
+            else:
+                self.workspaces.pop(workspace_id, None)
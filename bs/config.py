@@ -31,3 +31,84 @@ class Config:
     isam_base_domain =  os.getenv('BS_ISAM_BASE_DOMAIN', 'https://isam.apps.us.bluescape.com')
     client_id = os.getenv('BS_CLIENT_ID', 'cbc5407f-1860-4a47-a61f-ec135715aea0')
     auth_redirect_url = os.getenv('BS_AUTH_REDIRECT', 'http://localhost:7860/bluescape/oauth_callback')
+
+    # Number of images uploaded to Bluescape in parallel
+    upload_workers = int(os.getenv('BS_UPLOAD_WORKERS', '4'))
+    # Number of text elements created in parallel
+    element_workers = int(os.getenv('BS_ELEMENT_WORKERS', '8'))
+
+    # Keep-alive connections kept open per host, and number of hosts to keep pools for
+    http_pool_size = int(os.getenv('BS_HTTP_POOL_SIZE', str(max(upload_workers, element_workers))))
+    http_max_hosts = int(os.getenv('BS_HTTP_MAX_HOSTS', '10'))
+    # Whether to open connections ahead of the first upload request
+    http_prewarm = os.getenv('BS_HTTP_PREWARM', 'true').lower() == 'true'
+
+    # Retries for failed Bluescape requests, with exponential backoff (in seconds)
+    retry_max_attempts = int(os.getenv('BS_RETRY_MAX_ATTEMPTS', '5'))
+    retry_base_delay = float(os.getenv('BS_RETRY_BASE_DELAY', '0.5'))
+    retry_max_delay = float(os.getenv('BS_RETRY_MAX_DELAY', '30'))
+
+    # Seconds to wait before trying a spooled upload again when Bluescape could not be reached
+    spool_retry_interval = int(os.getenv('BS_SPOOL_RETRY_INTERVAL', '60'))
+
+    # Images encoded in parallel, and zlib level used for the default PNG encoding (0-9)
+    encode_workers = int(os.getenv('BS_ENCODE_WORKERS', str(min(4, os.cpu_count() or 1))))
+    png_compress_level = int(os.getenv('BS_PNG_COMPRESS_LEVEL', '6'))
+
+    # Largest width or height of an uploaded image, larger images are downscaled (0 for no limit)
+    max_upload_dimension = int(os.getenv('BS_MAX_UPLOAD_DIMENSION', '0'))
+
+    # Whether source images and masks already uploaded to a workspace are copied instead of uploaded again
+    dedup_source_images = os.getenv('BS_DEDUP_SOURCE_IMAGES', 'true').lower() == 'true'
+
+    # Memory the encoded images of an upload may take up at any one time, in megabytes
+    upload_memory_budget_mb = int(os.getenv('BS_UPLOAD_MEMORY_BUDGET_MB', '512'))
+
+    # Send image uploads with Transfer-Encoding: chunked instead of a Content-Length.
+    # The S3 presigned POST requires a Content-Length, so only for storage that supports it.
+    chunked_uploads = os.getenv('BS_CHUNKED_UPLOADS', 'false').lower() == 'true'
+
+    # How long the canvases of a workspace are cached for placing new canvases, in seconds
+    canvas_cache_ttl = float(os.getenv('BS_CANVAS_CACHE_TTL', '300'))
+
+    # Propose the canvas location from the cached workspace canvases, and only confirm it
+    # with Bluescape, instead of searching for space on the server
+    local_placement = os.getenv('BS_LOCAL_PLACEMENT', 'true').lower() == 'true'
+
+    # After creating a canvas, check it doesn't overlap a canvas another machine created at the
+    # same time, and move it if it does. Reservations only cover the uploaders on this machine, so
+    # this is on by default. Costs a short wait and a listing of the workspace canvases per upload.
+    verify_placement = os.getenv('BS_VERIFY_PLACEMENT', 'true').lower() == 'true'
+    placement_verify_attempts = int(os.getenv('BS_PLACEMENT_VERIFY_ATTEMPTS', '3'))
+    # Seconds to wait before checking, doubled on each attempt
+    placement_verify_delay = float(os.getenv('BS_PLACEMENT_VERIFY_DELAY', '1.0'))
+
+    # Canvases listed per request when looking for the latest canvas
+    canvas_page_size = int(os.getenv('BS_CANVAS_PAGE_SIZE', '100'))
+    # Order of the canvas listing, e.g. 'createdAt desc'. Newest first lets placement stop at the
+    # first page with a matching canvas, so only set it for a server known to honor the order.
+    # Empty, the default, always lists all canvases.
+    canvas_listing_order = os.getenv('BS_CANVAS_LISTING_ORDER', '')
+
+    # Images listed per request when rebuilding the index of uploaded images
+    image_page_size = int(os.getenv('BS_IMAGE_PAGE_SIZE', '100'))
+
+    # How long the cached workspace list is used before it is refreshed in the background, in seconds
+    workspace_cache_ttl = float(os.getenv('BS_WORKSPACE_CACHE_TTL', '3600'))
+    # Pages of 100 workspaces loaded up front, more are loaded on demand
+    workspace_initial_pages = int(os.getenv('BS_WORKSPACE_INITIAL_PAGES', '3'))
+
+    # Workspaces shown in the workspace dropdown, the rest are found by searching
+    workspace_search_results = int(os.getenv('BS_WORKSPACE_SEARCH_RESULTS', '20'))
+
+    # Changes to the settings within this many seconds are written to the state file together
+    state_save_delay = float(os.getenv('BS_STATE_SAVE_DELAY', '0.5'))
+
+    # How long a status stream or long-poll request waits for a change before checking in again, in seconds
+    status_wait_timeout = float(os.getenv('BS_STATUS_WAIT_TIMEOUT', '25'))
+
+    # Append the timing spans of each upload to this file, in the OpenTelemetry JSON format (one trace per line)
+    trace_file = os.getenv('BS_TRACE_FILE', '')
+    # Send the timing spans of each upload to an OpenTelemetry collector, e.g. http://localhost:4318/v1/traces
+    trace_collector_url = os.getenv('BS_TRACE_COLLECTOR_URL', '')
+    trace_service_name = os.getenv('BS_TRACE_SERVICE_NAME', 'sd-webui-bluescape')
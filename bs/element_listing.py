@@ -0,0 +1,63 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def parse_element_listing(stream, from_element, new_item, on_item_event):
+    """
+    Parses an element listing as it is read from the stream, into one item per element.
+    The element dicts, with all of their traits, are never built.
+
+    :param from_element: Makes the item for an element dict, used when ijson isn't installed.
+    :param new_item: Makes an empty item at the start of each element.
+    :param on_item_event: Called with the item and each (prefix, event, value) of the element as
+    parsed by ijson, to fill in the fields of the item.
+    :return: The items and the cursor of the next page, if any.
+    """
+    if ijson is None:
+        # Without ijson the listing has to be loaded in full
+        result = json.load(stream)
+        return [from_element(element) for element in result.get("data", [])], result.get("next")
+
+    items = []
+    item = None
+    cursor = None
+
+    for prefix, event, value in ijson.parse(stream, use_float = True):
+        if prefix == "data.item":
+            if event == "start_map":
+                item = new_item()
+            elif event == "end_map":
+                items.append(item)
+                item = None
+        elif item is not None:
+            on_item_event(item, prefix, event, value)
+        elif prefix == "next" and event == "string":
+            cursor = value
+
+    return items, cursor
@@ -28,30 +28,59 @@ from typing import Tuple
 from .expired_token_exception import ExpiredTokenException
 from .templates import bluescape_auth_function, bluescape_open_workspace_function, login_endpoint_page, refresh_ui_page, registration_endpoint_page
 from .config import Config
+from .http_client import http_client
 from .analytics import Analytics
-from .bluescape_api import bs_create_extended_data, bs_create_canvas_at, bs_create_generation_label, bs_create_generation_data, bs_create_label, bs_create_seed, bs_create_top_title, bs_find_space, bs_get_existing_canvases, bs_upload_image_at, bs_get_user_info
+from .bluescape_api import bs_create_canvas_at, bs_create_texts_with_bodies, bs_copy_image_at, bs_delete_element, bs_find_space, bs_get_canvas_summaries, bs_get_existing_images, bs_upload_images_at, bs_get_user_info
 from .state_manager import StateManager
-from .misc import CanvasHeaderStrategy, extract_workspace_id, extract_token_exp, CanvasTitleStrategy, SuggestedCanvasBorderColors
+from .asset_index import AssetIndex
+from .canvas_cache import CanvasCache
+from .placement_reservations import PlacementReservations
+from .job_registry import JobRegistry
+from . import metrics
+from .saved_images import SavedImages
+from .status_channel import StatusChannel, UncompressedPathsMiddleware
+from .upload_executor import UploadOutcome, run_upload_job
+from .upload_job import UploadJob
+from .upload_queue import UploadQueue
+from .upload_spool import UploadSpool
+from .misc import CanvasHeaderStrategy, extract_token_exp, CanvasTitleStrategy, ImageEncoding, SuggestedCanvasBorderColors
 import gradio as gr
 import modules.scripts as scripts
 import uuid
 import math
 import pkce
 from modules import script_callbacks
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
-import requests
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
 import random
+import threading
+import traceback
 
 class BluescapeUploadManager:
 
     state = StateManager()
     analytics = Analytics(state)
+    upload_queue = UploadQueue()
+    # Writes the images of background jobs to the spool as soon as they are queued,
+    # without waiting behind the uploads
+    encode_queue = UploadQueue("bluescape-encode-queue")
+    upload_spool = UploadSpool(state.data_dir)
+    asset_index = AssetIndex(state.data_dir)
+    saved_images = SavedImages()
+    status_channel = StatusChannel()
+    job_registry = JobRegistry()
+    canvas_cache = CanvasCache()
+    placement_reservations = PlacementReservations(state.data_dir)
+    # Upload ids of spooled jobs that are queued or waiting to be retried
+    spooled_upload_ids = set()
 
     def initialize(self):
         self.state.load()
+        self.resume_spooled_uploads()
         script_callbacks.on_ui_tabs(self.on_ui_tabs)
         script_callbacks.on_app_started(self.on_app_start)
+        script_callbacks.on_image_saved(self.saved_images.on_image_saved)
+        metrics.upload_queue_depth.get_value = self.get_pending_uploads
 
     def bluescape_login_endpoint(self):
         self.code_verifier, challenge = pkce.generate_pkce_pair()
@@ -61,7 +90,7 @@ class BluescapeUploadManager:
         print("Received callback on /bluescape/oauth_callback")
         url = f"{Config.isam_base_domain}/api/v3/oauth2/token"
 
-        response = requests.post(url, headers = {
+        response = http_client.post(url, headers = {
             'Content-Type': 'application/x-www-form-urlencoded'
         },
 
@@ -87,6 +116,7 @@ class BluescapeUploadManager:
             self.state.token_expired = False
             self.analytics.send_user_logged_in_event(token, user_id)
             self.state.refresh_workspaces(token)
+            self.resume_spooled_uploads()
             return refresh_ui_page()
         else:
             print("OAuth error:")
@@ -97,7 +127,10 @@ class BluescapeUploadManager:
         self.state.flush_user_data()
         return refresh_ui_page()
 
-    def bluescape_status_endpoint(self):
+    def refresh_status(self):
+        """
+        Publishes the status shown in the browser, if it has changed.
+        """
 
         # Check whether token expired
         # The token expiration is in UTC, so we need to get the
@@ -112,7 +145,57 @@ class BluescapeUploadManager:
         if selected_workspace_item is None:
             selected_workspace_item = " "
 
-        return self.state.txt2img_status + "\n" + self.state.img2img_status + "\n" + selected_workspace_item + "\n" + str(self.state.token_expired)
+        self.status_channel.publish(self.state.txt2img_status + "\n" + self.state.img2img_status + "\n" + selected_workspace_item + "\n" + str(self.state.token_expired))
+
+    async def bluescape_status_endpoint(self, request: Request, wait: float = 0):
+        """
+        :param wait: Seconds to wait for the status to change when the client already has the
+        current status (If-None-Match), for clients that can't use the status stream.
+        """
+
+        self.refresh_status()
+        version, status = self.status_channel.get()
+
+        if request.headers.get("if-none-match") == f'"{version}"':
+            if wait <= 0:
+                return Response(status_code=304)
+
+            await self.status_channel.wait_for_change(version, min(wait, Config.status_wait_timeout))
+            self.refresh_status()
+            version, status = self.status_channel.get()
+            if request.headers.get("if-none-match") == f'"{version}"':
+                return Response(status_code=304)
+
+        return HTMLResponse(status, headers={"ETag": f'"{version}"', "Cache-Control": "no-cache"})
+
+    async def bluescape_status_stream_endpoint(self, request: Request):
+        """
+        Server-sent events with the status, sent whenever it changes.
+        """
+
+        async def events():
+            sent_version = None
+            while not await request.is_disconnected():
+                self.refresh_status()
+                version, status = self.status_channel.get()
+
+                if version != sent_version:
+                    data = "".join(f"data: {line}\n" for line in status.split("\n"))
+                    yield f"id: {version}\n{data}\n"
+                    sent_version = version
+                else:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+
+                await self.status_channel.wait_for_change(sent_version, Config.status_wait_timeout)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    def bluescape_jobs_endpoint(self):
+        return self.job_registry.to_dict()
+
+    def bluescape_metrics_endpoint(self):
+        return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
     def bluescape_register_endpoint(self):
         registration_attempt_id = str(uuid.uuid4())
@@ -127,6 +210,8 @@ class BluescapeUploadManager:
         else:
             self.state.img2img_status = status
 
+        self.refresh_status()
+
     def on_app_start(self, _, app: FastAPI):
         app.add_api_route("/bluescape/login", self.bluescape_login_endpoint, methods=["GET"],
         response_class=HTMLResponse)
@@ -135,37 +220,133 @@ class BluescapeUploadManager:
         app.add_api_route("/bluescape/registration", self.bluescape_register_endpoint, methods=["GET"], response_class=HTMLResponse)
         app.add_api_route("/bluescape/logout", self.bluescape_logout_endpoint, methods=["GET"], response_class=HTMLResponse)
         app.add_api_route("/bluescape/status", self.bluescape_status_endpoint, methods=["GET"], response_class=HTMLResponse)
+        app.add_api_route("/bluescape/status/stream", self.bluescape_status_stream_endpoint, methods=["GET"])
+        app.add_api_route("/bluescape/jobs", self.bluescape_jobs_endpoint, methods=["GET"])
+        app.add_api_route("/bluescape/metrics", self.bluescape_metrics_endpoint, methods=["GET"])
+
+        # Added outside of the GZipMiddleware of A1111, the same way A1111 adds its middleware
+        # to an app that may already have built its middleware stack
+        app.middleware_stack = None
+        app.add_middleware(UncompressedPathsMiddleware, paths=["/bluescape/status/stream"])
+        app.build_middleware_stack()
         print("Bluescape endpoints have been mounted")
 
-    def upload_image_at(self, buffer, filename, bounding_box: Tuple[int, int, int, int], traits):
-        bs_upload_image_at(self.state.user_token, self.state.selected_workspace_id, buffer, filename, bounding_box, traits)
-
-    def create_canvas_at(self, title, bounding_box: Tuple[int, int, int, int], traits, canvas_color):
-        return bs_create_canvas_at(self.state.user_token, self.state.selected_workspace_id, title, bounding_box, traits, canvas_color)
-
-    def find_space(self, bounding_box: Tuple[int, int, int, int], direction) -> Tuple[int, int, int, int]:
-        return bs_find_space(self.state.user_token, self.state.selected_workspace_id, bounding_box, direction)
-
-    def get_existing_canvases(self):
-        return bs_get_existing_canvases(self.state.user_token, self.state.selected_workspace_id)
-
-    def create_top_title(self, location: Tuple[int, int, int], title, header):
-        return bs_create_top_title(self.state.user_token, self.state.selected_workspace_id, location, title, header)
-
-    def create_extended_data(self, location: Tuple[int, int, int], extended_generation_data):
-        return bs_create_extended_data(self.state.user_token, self.state.selected_workspace_id, location, extended_generation_data)
-
-    def create_generation_data(self, location: Tuple[int, int, int], infotext):
-        return bs_create_generation_data(self.state.user_token, self.state.selected_workspace_id, location, infotext)
-
-    def create_seed_label(self, location: Tuple[int, int, int], seed, subseed):
-        return bs_create_seed(self.state.user_token, self.state.selected_workspace_id, location, seed, subseed)
-
-    def create_label(self, location: Tuple[int, int, int], text):
-        return bs_create_label(self.state.user_token, self.state.selected_workspace_id, location, text)
-
-    def create_generation_label(self, location: Tuple[int, int, int], text):
-        return bs_create_generation_label(self.state.user_token, self.state.selected_workspace_id, location, text)
+    def submit_upload(self, job: UploadJob):
+        if self.state.background_upload:
+            # Let the generation thread continue while we upload. The job is
+            # spooled to disk first, so it survives a restart.
+            self.upload_spool.add(job)
+            self.spooled_upload_ids.add(job.upload_id)
+            self.job_registry.queue(job)
+            self.encode_queue.submit(self.spool_images, job)
+            self.set_status(f"Queued for upload ({self.get_pending_uploads()} pending)...", job.is_txt2img)
+        else:
+            # Without the spool there is no later attempt
+            run_upload_job(self, job, can_retry = False)
+
+    def submit_spooled_upload(self, job: UploadJob):
+        self.spooled_upload_ids.add(job.upload_id)
+        self.job_registry.queue(job)
+        self.upload_queue.submit(self.run_spooled_upload, job)
+
+    def spool_images(self, job: UploadJob):
+        try:
+            self.upload_spool.store_images(job)
+        except Exception as e:
+            print(f"Storing the images of the upload failed - (upload_id: {job.upload_id})")
+            traceback.print_exc()
+            self.job_registry.add_error(job.upload_id, e)
+            self.job_registry.finish(job.upload_id, "failed")
+            self.spooled_upload_ids.discard(job.upload_id)
+            self.upload_spool.remove(job.upload_id)
+            return
+
+        self.upload_queue.submit(self.run_spooled_upload, job)
+
+    def run_spooled_upload(self, job: UploadJob):
+        try:
+            outcome = run_upload_job(self, job, self.upload_spool)
+        except Exception as e:
+            print(f"Upload failed unexpectedly - (upload_id: {job.upload_id})")
+            traceback.print_exc()
+            self.job_registry.add_error(job.upload_id, e)
+            self.job_registry.finish(job.upload_id, "failed")
+            outcome = UploadOutcome.Failed
+
+        if outcome == UploadOutcome.Retry and not self.state.token_expired:
+            print(f"Upload will be retried in {Config.spool_retry_interval} seconds - (upload_id: {job.upload_id})")
+            timer = threading.Timer(Config.spool_retry_interval, self.upload_queue.submit, args=(self.run_spooled_upload, job))
+            timer.daemon = True
+            timer.start()
+            return
+
+        self.spooled_upload_ids.discard(job.upload_id)
+        if outcome != UploadOutcome.Retry:
+            self.upload_spool.remove(job.upload_id)
+
+    def resume_spooled_uploads(self):
+        if self.is_empty_user_token():
+            return
+
+        for job in self.upload_spool.get_pending_jobs():
+            if job.upload_id in self.spooled_upload_ids:
+                # Already queued, or its images are still being written to the spool
+                continue
+
+            if any(upload_image.path is None for upload_image in job.images):
+                # A1111 stopped before the images of the job were written to the spool
+                print(f"Dropping spooled upload without its images - (upload_id: {job.upload_id})")
+                self.upload_spool.remove(job.upload_id)
+                continue
+
+            print(f"Resuming spooled upload - (upload_id: {job.upload_id})")
+            self.submit_spooled_upload(job)
+
+    def get_pending_uploads(self):
+        return self.encode_queue.pending() + self.upload_queue.pending()
+
+    def prewarm_connections(self):
+        if Config.http_prewarm and not self.is_empty_user_token():
+            http_client.prewarm()
+
+    # The functions below upload into the selected workspace, unless the
+    # workspace_id of a specific upload job is given
+
+    def upload_images_at(self, uploads, on_uploaded = None, workspace_id = None, image_format = 'png', on_failed = None):
+        return bs_upload_images_at(self.state.user_token, self.get_workspace_id(workspace_id), uploads, on_uploaded = on_uploaded, image_format = image_format, on_failed = on_failed)
+
+    def create_canvas_at(self, title, bounding_box: Tuple[int, int, int, int], traits, canvas_color, workspace_id = None):
+        workspace_id = self.get_workspace_id(workspace_id)
+        canvas_id = bs_create_canvas_at(self.state.user_token, workspace_id, title, bounding_box, traits, canvas_color)
+        self.canvas_cache.add_canvas(workspace_id, canvas_id, bounding_box, traits)
+        return canvas_id
+
+    def find_space(self, bounding_box: Tuple[int, int, int, int], direction, workspace_id = None) -> Tuple[int, int, int, int]:
+        return bs_find_space(self.state.user_token, self.get_workspace_id(workspace_id), bounding_box, direction)
+
+    def get_workspace_canvases(self, workspace_id = None, refresh = False, is_enough = None):
+        workspace_id = self.get_workspace_id(workspace_id)
+        if refresh:
+            self.canvas_cache.invalidate(workspace_id)
+        return self.canvas_cache.get(workspace_id, lambda cursor: self.get_canvas_summaries(cursor, workspace_id = workspace_id), is_enough)
+
+    def get_canvas_summaries(self, cursor = None, workspace_id = None):
+        return bs_get_canvas_summaries(self.state.user_token, self.get_workspace_id(workspace_id), cursor)
+
+    def delete_element(self, element_id, workspace_id = None):
+        return bs_delete_element(self.state.user_token, self.get_workspace_id(workspace_id), element_id)
+
+    def get_existing_images(self, cursor = None, workspace_id = None):
+        return bs_get_existing_images(self.state.user_token, self.get_workspace_id(workspace_id), cursor)
+
+    def copy_image_at(self, element_id, filename, bounding_box: Tuple[int, int, int, int], traits, workspace_id = None):
+        return bs_copy_image_at(self.state.user_token, self.get_workspace_id(workspace_id), element_id, filename, bounding_box, traits)
+
+    def create_text_elements(self, bodies, on_created = None, workspace_id = None, on_failed = None):
+        return bs_create_texts_with_bodies(self.state.user_token, self.get_workspace_id(workspace_id), bodies, on_created = on_created, on_failed = on_failed)
+
+    def get_workspace_id(self, workspace_id = None):
+        return workspace_id if workspace_id else self.state.selected_workspace_id
 
     def get_enable_verbose(self):
         return self.state.enable_verbose
@@ -179,6 +360,15 @@ class BluescapeUploadManager:
     def get_scale_to_standard_size(self):
         return self.state.scale_to_standard_size
 
+    def get_downscale_to_standard_size(self):
+        return self.state.downscale_to_standard_size
+
+    def get_background_upload(self):
+        return self.state.background_upload
+
+    def get_image_encoding(self):
+        return self.state.image_encoding
+
     def get_enable_metadata(self):
         return self.state.enable_metadata
 
@@ -223,19 +413,21 @@ class BluescapeUploadManager:
 
             token_source = gr.Textbox(self.get_user_token, visible=False)
 
-            # Outputs: workspaces_dropdown, workspace_to_open_textbox, register_button, refresh_workspaces_button, open_workspace_button, login_button, logout_button
-            def refresh_workspaces_and_ui(input):
+            # Outputs: workspaces_dropdown, workspace_to_open_textbox, register_button, refresh_workspaces_button, open_workspace_button, login_button, logout_button, load_more_workspaces_button, workspace_search_textbox
+            def refresh_workspaces_and_ui(input, force = False):
                 try:
-                    self.state.refresh_workspaces(input)
+                    self.state.refresh_workspaces(input, force)
                     ws_value = self.state.workspace_ids.get(self.state.selected_workspace_id, self.state.workspace_dd[0])
                     return [
-                        gr.Dropdown.update(choices=self.state.workspace_dd, visible=True, value=ws_value),
+                        gr.Dropdown.update(choices=self.state.search_workspaces(""), visible=True, value=ws_value),
                         gr.Textbox.update(value=self.state.selected_workspace_id),
                         gr.Button.update(visible=False),
                         gr.Button.update(visible=True),
                         gr.Button.update(visible=True),
                         gr.Button.update(visible=False),
-                        gr.Button.update(visible=True)
+                        gr.Button.update(visible=True),
+                        gr.Button.update(visible=self.state.workspace_cache.has_more()),
+                        gr.Textbox.update(visible=True)
                     ]
                 except ExpiredTokenException:
                     print("Bluescape token has expired")
@@ -251,9 +443,38 @@ class BluescapeUploadManager:
                         gr.Button.update(visible=False),
                         gr.Button.update(visible=True),
                         gr.Button.update(visible=False),
-                        gr.Checkbox.update(visible=True)
+                        gr.Button.update(visible=False),
+                        gr.Textbox.update(visible=False)
                     ]
 
+            # The refresh button always asks Bluescape, page loads use the cached workspaces
+            def force_refresh_workspaces_and_ui(input):
+                return refresh_workspaces_and_ui(input, force = True)
+
+            def load_more_workspaces(input, query):
+                try:
+                    self.state.load_more_workspaces(input)
+                except ExpiredTokenException:
+                    print("Bluescape token has expired")
+                    self.state.token_expired = True
+
+                return [
+                    gr.Dropdown.update(choices=self.state.search_workspaces(query)),
+                    gr.Button.update(visible=self.state.workspace_cache.has_more())
+                ]
+
+            # Typing only searches the loaded workspaces, Enter searches Bluescape as well
+            def workspace_search_change(query):
+                return gr.Dropdown.update(choices=self.state.search_workspaces(query))
+
+            def workspace_search_submit(query, input):
+                try:
+                    return gr.Dropdown.update(choices=self.state.search_workspaces(query, input))
+                except ExpiredTokenException:
+                    print("Bluescape token has expired")
+                    self.state.token_expired = True
+                    return gr.Dropdown.update(choices=self.state.search_workspaces(query))
+
             with gr.Row():
                 with gr.Column():
                     with gr.Row():
@@ -287,13 +508,16 @@ class BluescapeUploadManager:
                         with gr.Column():
                             register_button = gr.Button(value="Register for a free account", visible=self.is_empty_user_token())
                     with gr.Row():
-                        workspaces_dropdown = gr.Dropdown(choices=self.get_workspace_dd(), label="Select target workspace:", value=self.get_selected_workspace_item, elem_id="bluescape-workspaces-dropdown", visible=(not self.is_empty_user_token()))
+                        workspace_search_textbox = gr.Textbox(label="Search workspaces", placeholder="Workspace name or id", visible=(not self.is_empty_user_token()))
+                    with gr.Row():
+                        workspaces_dropdown = gr.Dropdown(choices=self.state.search_workspaces(""), label="Select target workspace:", value=self.get_selected_workspace_item, elem_id="bluescape-workspaces-dropdown", visible=(not self.is_empty_user_token()))
                     with gr.Row():
                         with gr.Column():
                             workspace_to_open_textbox = gr.Textbox(label="Workspace to open", value=self.get_selected_workspace_item, elem_id="bluescape-open-workspace-id", visible=False)
                             open_workspace_button = gr.Button("Open target workspace", visible=(not self.is_empty_user_token()))
                         with gr.Column():
                             refresh_workspaces_button = gr.Button("Refresh workspaces", visible=(not self.is_empty_user_token()))
+                            load_more_workspaces_button = gr.Button("Load more workspaces", visible=(not self.is_empty_user_token() and self.state.workspace_cache.has_more()))
                     with gr.Row():
                         gr.Markdown(
                             """
@@ -305,6 +529,9 @@ class BluescapeUploadManager:
                     img2img_include_init_images_checkbox = gr.Checkbox(label="Include source image in workspace (img2img)", value=self.get_img2img_include_init_images, interactive=True)
                     img2img_include_mask_image_checkbox = gr.Checkbox(label="Include image mask in workspace (img2img)", value=self.get_img2img_include_mask_image, interactive=True)
                     scale_to_standard_size_checkbox = gr.Checkbox(label="Scale images to standard size (1000x1000) in workspace", value=self.get_scale_to_standard_size, interactive=True)
+                    downscale_to_standard_size_checkbox = gr.Checkbox(label="Downscale images to standard size before upload (when scaling to standard size)", value=self.get_downscale_to_standard_size, interactive=True)
+                    background_upload_checkbox = gr.Checkbox(label="Upload in the background without blocking image generation", value=self.get_background_upload, interactive=True)
+                    image_encoding_dropdown = gr.Dropdown(label="Image format for uploads", choices=[encoding.value for encoding in ImageEncoding], value=self.get_image_encoding, interactive=True)
                     enable_metadata_checkbox = gr.Checkbox(label="Store generation data as metadata in image object within workspace", value=self.get_enable_metadata, interactive=True)
                     enable_analytics_checkbox = gr.Checkbox(label="Send extension usage analytics", value=self.get_enable_analytics, interactive=True)
 
@@ -337,7 +564,7 @@ class BluescapeUploadManager:
                             """
                         )
 
-                    token_source.change(refresh_workspaces_and_ui, inputs=[token_source], outputs=[workspaces_dropdown, workspace_to_open_textbox, register_button, refresh_workspaces_button, open_workspace_button, login_button, logout_button])
+                    token_source.change(refresh_workspaces_and_ui, inputs=[token_source], outputs=[workspaces_dropdown, workspace_to_open_textbox, register_button, refresh_workspaces_button, open_workspace_button, login_button, logout_button, load_more_workspaces_button, workspace_search_textbox])
 
 
                 with gr.Column():
@@ -346,8 +573,9 @@ class BluescapeUploadManager:
 
             def selected_workspace_change(input):
                 if input is not None and input != "":
-                    self.state.selected_workspace_id = extract_workspace_id(input)
+                    self.state.selected_workspace_id = self.state.get_workspace_id_by_item(input)
                     self.state.save()
+                    self.refresh_status()
 
                     return gr.Textbox.update(value=self.state.selected_workspace_id)
 
@@ -387,6 +615,18 @@ class BluescapeUploadManager:
                 self.state.scale_to_standard_size = input
                 self.state.save()
 
+            def downscale_to_standard_size_change(input):
+                self.state.downscale_to_standard_size = input
+                self.state.save()
+
+            def background_upload_change(input):
+                self.state.background_upload = input
+                self.state.save()
+
+            def image_encoding_dropdown_change(input):
+                self.state.image_encoding = input
+                self.state.save()
+
             def canvas_title_dropdown_change(input):
                 self.state.canvas_title_strategy = input
                 self.state.save()
@@ -404,12 +644,18 @@ class BluescapeUploadManager:
             logout_button.click(None, _js="bluescape_logout")
             open_workspace_button.click(None, _js=bluescape_open_workspace_function)
             register_button.click(None, _js="bluescape_registration")
-            refresh_workspaces_button.click(refresh_workspaces_and_ui, inputs=[token_source], outputs=[workspaces_dropdown, workspace_to_open_textbox, register_button, refresh_workspaces_button, open_workspace_button, login_button, logout_button])
+            refresh_workspaces_button.click(force_refresh_workspaces_and_ui, inputs=[token_source], outputs=[workspaces_dropdown, workspace_to_open_textbox, register_button, refresh_workspaces_button, open_workspace_button, login_button, logout_button, load_more_workspaces_button, workspace_search_textbox])
+            load_more_workspaces_button.click(load_more_workspaces, inputs=[token_source, workspace_search_textbox], outputs=[workspaces_dropdown, load_more_workspaces_button])
+            workspace_search_textbox.change(workspace_search_change, inputs=[workspace_search_textbox], outputs=[workspaces_dropdown])
+            workspace_search_textbox.submit(workspace_search_submit, inputs=[workspace_search_textbox, token_source], outputs=[workspaces_dropdown])
             workspaces_dropdown.change(selected_workspace_change, inputs=[workspaces_dropdown], outputs=[workspace_to_open_textbox])
             enable_verbose_checkbox.change(enable_verbose_change, inputs=[enable_verbose_checkbox])
             img2img_include_init_images_checkbox.change(img2img_include_init_images_change, inputs=[img2img_include_init_images_checkbox])
             img2img_include_mask_image_checkbox.change(img2img_include_mask_image_change, inputs=[img2img_include_mask_image_checkbox])
             scale_to_standard_size_checkbox.change(scale_to_standard_size_change, inputs=[scale_to_standard_size_checkbox])
+            downscale_to_standard_size_checkbox.change(downscale_to_standard_size_change, inputs=[downscale_to_standard_size_checkbox])
+            background_upload_checkbox.change(background_upload_change, inputs=[background_upload_checkbox])
+            image_encoding_dropdown.change(image_encoding_dropdown_change, inputs=[image_encoding_dropdown])
             enable_metadata_checkbox.change(enable_metadata_change, inputs=[enable_metadata_checkbox])
             enable_analytics_checkbox.change(enable_analytics_change, inputs=[enable_analytics_checkbox])
             user_swimlane_checkbox.change(user_swimlane_change, inputs=[user_swimlane_checkbox])
@@ -0,0 +1,143 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from .config import Config
+from . import metrics
+from .retry_policy import RetryPolicy
+
+class HttpClient:
+    """
+    Shared keep-alive HTTP client for all calls to Bluescape (API, S3, analytics
+    and ISAM). Connections are pooled per host, so consecutive requests of a batch
+    reuse the same TCP and TLS connection instead of doing a new handshake each time.
+    """
+
+    # How long a prewarm is considered fresh
+    prewarm_interval = 30
+
+    def __init__(self, pool_size = Config.http_pool_size, max_hosts = Config.http_max_hosts, retry_policy = None):
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = max_hosts, pool_maxsize = pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.pool_size = pool_size
+        # Hosts we have talked to, e.g. the S3 bucket which is only known after the first upload
+        self.known_hosts = set()
+        self.last_prewarm = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, idempotent = None, retry_policy = None, **kwargs):
+        """
+        Sends the request, retrying it according to the retry policy.
+
+        :param idempotent: Whether the request can safely be sent more than once. Defaults to True for GET, HEAD, PUT and DELETE.
+        :param retry_policy: Overrides the client retry policy for this request.
+        """
+
+        host = self._get_host(url)
+        self.known_hosts.add(host)
+
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD", "PUT", "DELETE")
+        policy = retry_policy if retry_policy is not None else self.retry_policy
+
+        attempt = 0
+        while True:
+            attempt += 1
+
+            # A streamed body has to be sent again from the start
+            body = kwargs.get("data")
+            if attempt > 1 and hasattr(body, "seek"):
+                body.seek(0)
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                metrics.http_requests.inc(host = host, method = method, status = type(e).__name__)
+                if not policy.should_retry_error(e, attempt, idempotent):
+                    raise
+                delay = policy.get_delay(attempt)
+                print(f"{method} {host} failed ({type(e).__name__}), retrying in {delay:.1f}s (attempt {attempt} of {policy.max_attempts})")
+            else:
+                metrics.http_requests.inc(host = host, method = method, status = response.status_code)
+                metrics.http_request_duration.observe(time.perf_counter() - start, host = host, method = method)
+                metrics.record_response_status(response.status_code)
+
+                if not policy.should_retry_response(response, attempt, idempotent):
+                    return response
+                delay = policy.get_delay(attempt, response)
+                print(f"{method} {host} returned {response.status_code}, retrying in {delay:.1f}s (attempt {attempt} of {policy.max_attempts})")
+                # Hands the connection back to the pool, also when the response is streamed
+                response.close()
+
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def prewarm(self, hosts = None, connections = Config.upload_workers):
+        """
+        Opens connections to the given hosts in the background, so that the first
+        requests of an upload do not have to pay for the handshake.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_prewarm < self.prewarm_interval:
+                return
+            self.last_prewarm = now
+
+        if hosts is None:
+            hosts = {self._get_host(Config.api_base_domain)} | self.known_hosts
+
+        connections = max(1, min(connections, self.pool_size))
+        for host in hosts:
+            for _ in range(connections):
+                threading.Thread(target=self._open_connection, args=(host,), name="bluescape-prewarm", daemon=True).start()
+
+    def _open_connection(self, host):
+        try:
+            # Any response will do, we are only interested in the connection
+            self.session.head(host, timeout = 5, allow_redirects = False)
+        except Exception:
+            pass
+
+    def _get_host(self, url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+http_client = HttpClient()
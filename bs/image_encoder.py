@@ -0,0 +1,155 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from PIL import Image
+from .config import Config
+from .misc import ImageEncoding
+from . import metrics, tracing
+
+# Pillow releases the GIL while compressing, so threads are enough to encode
+# several images in parallel, without copying the pixels to another process.
+encoder_pool = ThreadPoolExecutor(max_workers = Config.encode_workers, thread_name_prefix = "bluescape-encode")
+
+def get_image_encoding(value) -> ImageEncoding:
+    try:
+        return ImageEncoding(value)
+    except ValueError:
+        return ImageEncoding.Png
+
+def get_image_format(encoding: ImageEncoding):
+    """
+    :return: The imageFormat used for the Bluescape image element.
+    """
+    if encoding == ImageEncoding.WebpLossless:
+        return "webp"
+    elif encoding == ImageEncoding.Jpeg:
+        return "jpeg"
+    return "png"
+
+def get_file_extension(encoding: ImageEncoding):
+    if encoding == ImageEncoding.WebpLossless:
+        return "webp"
+    elif encoding == ImageEncoding.Jpeg:
+        return "jpg"
+    return "png"
+
+def get_upload_size(size: Tuple[int, int], max_size: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """
+    Calculates the size to upload an image at, so that it fits within max_size
+    while keeping its aspect ratio. Images are never upscaled.
+    """
+    width, height = size
+    if max_size is None:
+        return size
+
+    max_width, max_height = max_size
+    scale = min(max_width / width, max_height / height)
+    if scale >= 1:
+        return size
+
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+def encode_image(image, encoding: ImageEncoding, max_size: Optional[Tuple[int, int]] = None) -> memoryview:
+    """
+    :return: The encoded image, as a view of the encoder buffer to avoid copying it.
+    """
+    data = io.BytesIO()
+    start = time.perf_counter()
+
+    with tracing.span("encode_image", format = encoding.name):
+        upload_size = get_upload_size(image.size, max_size)
+        if upload_size != image.size:
+            image = image.resize(upload_size, Image.LANCZOS)
+
+        if encoding == ImageEncoding.PngFast:
+            image.save(data, format="PNG", compress_level=1)
+        elif encoding == ImageEncoding.WebpLossless:
+            image.save(data, format="WEBP", lossless=True, method=4)
+        elif encoding == ImageEncoding.Jpeg:
+            # JPEG has no alpha channel, masks are fine as greyscale
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(data, format="JPEG", quality=95, subsampling=0)
+        else:
+            image.save(data, format="PNG", compress_level=Config.png_compress_level)
+
+    metrics.encode_duration.observe(time.perf_counter() - start, format = encoding.name)
+    return data.getbuffer()
+
+def encode_images(images, encoding: ImageEncoding, max_size: Optional[Tuple[int, int]] = None):
+    """
+    Encodes the images in parallel on the encoder pool.
+
+    :return: A list of encoded images, in the same order as images.
+    """
+    encode = tracing.propagate(lambda image: encode_image(image, encoding, max_size))
+    return list(encoder_pool.map(encode, images))
+
+def get_data_size(data):
+    if hasattr(data, "fileno"):
+        return os.fstat(data.fileno()).st_size
+    if isinstance(data, memoryview):
+        return data.nbytes
+    return len(data)
+
+class PendingImageData:
+    """
+    Image data that is only produced, on the encoder pool, when entering the with
+    block. The estimated size is reserved from the memory budget until the block exits.
+    """
+
+    def __init__(self, produce, estimated_size, budget = None):
+        self.produce = produce
+        self.estimated_size = estimated_size
+        self.budget = budget
+        self.reserved = 0
+        self.data = None
+        # Size of the produced data, once produced
+        self.size = 0
+
+    def __enter__(self):
+        if self.budget is not None:
+            self.reserved = self.budget.acquire(self.estimated_size)
+        try:
+            self.data = encoder_pool.submit(tracing.propagate(self.produce)).result()
+            self.size = get_data_size(self.data)
+            return self.data
+        except BaseException:
+            self._release()
+            raise
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+        if hasattr(self.data, "close"):
+            self.data.close()
+        self.data = None
+
+    def _release(self):
+        if self.budget is not None and self.reserved:
+            self.budget.release(self.reserved)
+            self.reserved = 0
@@ -0,0 +1,164 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import threading
+import time
+from collections import deque
+from . import metrics
+
+class UploadJobProgress:
+    """
+    Progress of one upload job, as reported by /bluescape/jobs.
+    """
+
+    def __init__(self, upload_id, generation_type, workspace_id, images_total):
+        self.upload_id = upload_id
+        self.generation_type = generation_type
+        self.workspace_id = workspace_id
+        # One of "queued", "placement", "canvas", "texts", "images", "retrying", "complete" or "failed"
+        self.phase = "queued"
+        self.images_done = 0
+        self.images_total = images_total
+        self.bytes_sent = 0
+        self.errors = []
+        self.canvas_id = None
+        self.link = None
+        self.attempts = 0
+        self.attempt_started_at = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "generation_type": self.generation_type,
+            "workspace_id": self.workspace_id,
+            "phase": self.phase,
+            "images_done": self.images_done,
+            "images_total": self.images_total,
+            "bytes_sent": self.bytes_sent,
+            "errors": list(self.errors),
+            "canvas_id": self.canvas_id,
+            "link": self.link,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "finished_at": self.finished_at,
+            "duration": (self.finished_at or time.time()) - self.created_at
+        }
+
+class JobRegistry:
+    """
+    In-memory registry of the upload jobs by upload id. Active jobs are kept until
+    they complete or fail, after which they move into a bounded history.
+    """
+
+    def __init__(self, history_size = 100, max_errors = 20):
+        self.active = {}
+        self.history = deque(maxlen = history_size)
+        self.max_errors = max_errors
+        self.lock = threading.Lock()
+
+    def queue(self, job):
+        """
+        Registers the job as waiting in the upload queue.
+        """
+        with self.lock:
+            if job.upload_id not in self.active:
+                self.active[job.upload_id] = UploadJobProgress(job.upload_id, str(job.generation_type), job.workspace_id, job.get_num_images())
+                metrics.upload_batch_images.observe(job.get_num_images())
+
+    def start(self, job, images_done = 0):
+        """
+        Registers an attempt at uploading the job.
+
+        :param images_done: Images uploaded by an earlier attempt.
+        """
+        self.queue(job)
+        self.update(job.upload_id, phase = "placement", images_done = images_done)
+        with self.lock:
+            self.active[job.upload_id].attempts += 1
+            self.active[job.upload_id].attempt_started_at = time.time()
+
+    def update(self, upload_id, **fields):
+        with self.lock:
+            progress = self.active.get(upload_id)
+            if progress is None:
+                return
+            for name, value in fields.items():
+                setattr(progress, name, value)
+            progress.updated_at = time.time()
+
+    def image_uploaded(self, upload_id, num_bytes):
+        with self.lock:
+            progress = self.active.get(upload_id)
+            if progress is None:
+                return
+            progress.images_done += 1
+            progress.bytes_sent += num_bytes
+            progress.updated_at = time.time()
+        metrics.upload_images.inc()
+        metrics.upload_bytes.inc(num_bytes)
+
+    def add_error(self, upload_id, error, element = None):
+        """
+        :param element: The element or phase the error happened in.
+        """
+        with self.lock:
+            progress = self.active.get(upload_id)
+            if progress is None:
+                return
+            if len(progress.errors) < self.max_errors:
+                progress.errors.append({
+                    "element": element if element is not None else progress.phase,
+                    "error": str(error),
+                    "at": time.time()
+                })
+            progress.updated_at = time.time()
+
+    def finish(self, upload_id, phase):
+        """
+        :param phase: "complete" or "failed" moves the job into the history, anything else keeps it active.
+        """
+        with self.lock:
+            progress = self.active.get(upload_id)
+            if progress is None:
+                return
+            progress.phase = phase
+            progress.updated_at = time.time()
+            metrics.upload_jobs.inc(outcome = phase)
+            if progress.attempt_started_at is not None:
+                metrics.upload_duration.observe(progress.updated_at - progress.attempt_started_at, outcome = phase)
+                progress.attempt_started_at = None
+            if phase in ("complete", "failed"):
+                progress.finished_at = progress.updated_at
+                del self.active[upload_id]
+                self.history.append(progress)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "active": [progress.to_dict() for progress in self.active.values()],
+                "history": [progress.to_dict() for progress in reversed(self.history)]
+            }
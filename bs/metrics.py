@@ -0,0 +1,190 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import contextvars
+import functools
+import threading
+import time
+from . import tracing
+
+# Latency buckets in seconds, from quick API calls up to large uploads
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def format_labels(label_names, label_values, extra = ()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, label_names = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}")
+        return lines
+
+class Gauge:
+    """
+    Gauge whose value is read from a function when the metrics are collected.
+    """
+
+    def __init__(self, name, documentation, get_value = None):
+        self.name = name
+        self.documentation = documentation
+        self.get_value = get_value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if self.get_value is not None:
+            lines.append(f"{self.name} {format_value(self.get_value())}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, label_names = (), buckets = default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # Per label values: bucket counts, sum and count
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            bucket_counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            self.values[key] = (bucket_counts, total + value, count + 1)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (bucket_counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, [('le', format_value(bound))])} {bucket_count}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        :return: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+api_calls = registry.register(Counter("bluescape_api_calls_total", "Calls of the Bluescape API functions, by function and the status code of the last response.", ("function", "status")))
+api_call_duration = registry.register(Histogram("bluescape_api_call_duration_seconds", "Duration of the Bluescape API functions, including retries.", ("function", "status")))
+http_requests = registry.register(Counter("bluescape_http_requests_total", "HTTP requests sent, by host, method and status code.", ("host", "method", "status")))
+http_request_duration = registry.register(Histogram("bluescape_http_request_duration_seconds", "Duration of single HTTP requests.", ("host", "method")))
+upload_bytes = registry.register(Counter("bluescape_upload_bytes_total", "Bytes of image data uploaded."))
+upload_images = registry.register(Counter("bluescape_upload_images_total", "Images uploaded or copied into a workspace."))
+upload_jobs = registry.register(Counter("bluescape_upload_jobs_total", "Upload job attempts, by outcome.", ("outcome",)))
+upload_duration = registry.register(Histogram("bluescape_upload_duration_seconds", "Duration of upload job attempts, by outcome.", ("outcome",)))
+upload_batch_images = registry.register(Histogram("bluescape_upload_batch_images", "Images per upload job.", buckets = (1, 2, 4, 8, 16, 32, 64, 128)))
+encode_duration = registry.register(Histogram("bluescape_image_encode_duration_seconds", "Time spent encoding an image for upload, by format.", ("format",)))
+upload_queue_depth = registry.register(Gauge("bluescape_upload_queue_depth", "Upload jobs waiting in the background upload queue."))
+
+class ApiCall:
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = None
+
+# The API function being called on this thread, so HTTP responses can be attributed to it
+current_api_call = contextvars.ContextVar("bluescape_api_call", default = None)
+
+def record_response_status(status_code):
+    api_call = current_api_call.get()
+    if api_call is not None:
+        api_call.status = status_code
+
+def instrumented(name = None):
+    """
+    Decorator recording the calls and duration of an API function, by the
+    status code of the last response it got, or the exception it raised.
+    Calls within an upload are also recorded as spans of its trace.
+
+    Only for functions that send requests themselves, functions made of other
+    API calls would be counted on top of those, without a status of their own.
+    """
+    def decorator(fn):
+        function_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            api_call = ApiCall()
+            token = current_api_call.set(api_call)
+            status = None
+            start = time.perf_counter()
+            try:
+                with tracing.span(function_name):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                status = type(e).__name__
+                raise
+            finally:
+                current_api_call.reset(token)
+                if api_call.status is not None:
+                    status = api_call.status
+                elif status is None:
+                    status = "none"
+                api_calls.inc(function = function_name, status = status)
+                api_call_duration.observe(time.perf_counter() - start, function = function_name, status = status)
+
+        return wrapper
+
+    return decorator
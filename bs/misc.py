@@ -66,6 +66,12 @@ class SuggestedCanvasBorderColors(Enum):
     Magenta = "#ff00ff"
     Purple = "#800080"
 
+class ImageEncoding(Enum):
+    Png = "PNG (default)"
+    PngFast = "PNG, faster encoding with larger files"
+    WebpLossless = "WebP, lossless with smaller files"
+    Jpeg = "JPEG, high quality with smallest files (lossy)"
+
 class FindSpaceDirection(Enum):
     Right = "Right"
     Down = "Down"
@@ -89,35 +95,3 @@ def hex_to_bluescape_rgb(hex_color):
         'b': b,
         'a': 1
     }
-
-def find_on_key_value(json_list, key_to_find, value_to_find):
-    def search_dict(json_input, key_to_find, value_to_find):
-        if isinstance(json_input, dict):
-            if key_to_find in json_input and json_input[key_to_find] == value_to_find:
-                return True
-            for k, v in json_input.items():
-                if search_dict(v, key_to_find, value_to_find):
-                    return True
-        elif isinstance(json_input, list):
-            for item in json_input:
-                if search_dict(item, key_to_find, value_to_find):
-                    return True
-        return False
-
-    return [json_obj for json_obj in json_list if search_dict(json_obj, key_to_find, value_to_find)]
-
-def find_on_key(json_list, key_to_find):
-    def search_dict(json_input, key_to_find):
-        if isinstance(json_input, dict):
-            if key_to_find in json_input:
-                return True
-            for v in json_input.values():
-                if search_dict(v, key_to_find):
-                    return True
-        elif isinstance(json_input, list):
-            for item in json_input:
-                if search_dict(item, key_to_find):
-                    return True
-        return False
-
-    return [json_obj for json_obj in json_list if search_dict(json_obj, key_to_find)]
@@ -0,0 +1,129 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import io
+import os
+import uuid
+
+class MultipartStream:
+    """
+    A multipart/form-data body that is read straight from the image buffer,
+    instead of being assembled in memory. Bytes-like sources are served as
+    memoryview slices without copying, file objects are read in chunks.
+
+    Has a length, so requests sends it with a Content-Length, which the S3
+    presigned POST requires. Use chunked() for Transfer-Encoding: chunked.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, fields, file_field, filename, source, content_type = "application/octet-stream"):
+        self.boundary = uuid.uuid4().hex
+
+        preamble = io.BytesIO()
+        for name, value in fields.items():
+            preamble.write(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+        preamble.write(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode("utf-8"))
+        epilogue = f'\r\n--{self.boundary}--\r\n'.encode("utf-8")
+
+        self.parts = [memoryview(preamble.getvalue()), self._get_source_part(source), memoryview(epilogue)]
+        self.part_index = 0
+        self.part_offset = 0
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return sum(self._get_part_length(part) for part in self.parts)
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            return b"".join(bytes(chunk) for chunk in iter(lambda: self.read(self.chunk_size), b""))
+
+        while self.part_index < len(self.parts):
+            part = self.parts[self.part_index]
+            if isinstance(part, memoryview):
+                chunk = part[self.part_offset:self.part_offset + size]
+            else:
+                chunk = part.file.read(size)
+
+            if len(chunk) > 0:
+                self.part_offset += len(chunk)
+                return chunk
+
+            self.part_index += 1
+            self.part_offset = 0
+
+        return b""
+
+    def tell(self):
+        return sum(self._get_part_length(part) for part in self.parts[:self.part_index]) + self.part_offset
+
+    def seek(self, offset, whence = os.SEEK_SET):
+        # Only rewinding is supported, which is all that is needed to send the body again
+        if offset != 0 or whence != os.SEEK_SET:
+            raise io.UnsupportedOperation("MultipartStream can only be rewound")
+
+        self.part_index = 0
+        self.part_offset = 0
+        for part in self.parts:
+            if isinstance(part, _FilePart):
+                part.file.seek(part.start)
+        return 0
+
+    def chunked(self):
+        return _ChunkedBody(self)
+
+    def _get_source_part(self, source):
+        if isinstance(source, io.BytesIO):
+            return source.getbuffer()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return memoryview(source).cast("B")
+        return _FilePart(source)
+
+    def _get_part_length(self, part):
+        if isinstance(part, memoryview):
+            return part.nbytes
+        return part.length
+
+class _FilePart:
+
+    def __init__(self, file):
+        self.file = file
+        self.start = file.tell()
+        self.length = os.fstat(file.fileno()).st_size - self.start
+
+class _ChunkedBody:
+    """
+    Iterates over the body from the start every time, so it can be sent again on retry.
+    """
+
+    def __init__(self, stream: MultipartStream):
+        self.stream = stream
+
+    def __iter__(self):
+        self.stream.seek(0)
+        for chunk in iter(lambda: self.stream.read(self.stream.chunk_size), b""):
+            # The chunked sender only takes bytes
+            yield bytes(chunk)
@@ -0,0 +1,84 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+from typing import Tuple
+from .misc import FindSpaceDirection
+
+def overlaps(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+class OccupancyGrid:
+    """
+    Spatial index of the occupied areas of a workspace. Areas are bucketed into
+    square cells, so only the areas in the cells a bounding box touches need to
+    be checked for overlap.
+    """
+
+    def __init__(self, cell_size = 4096):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _get_cells(self, bounding_box: Tuple[int, int, int, int]):
+        x, y, width, height = bounding_box
+        # Areas are half open, an area ending where the next one starts doesn't overlap it
+        for i in range(int(x // self.cell_size), int((x + max(width, 1) - 1) // self.cell_size) + 1):
+            for j in range(int(y // self.cell_size), int((y + max(height, 1) - 1) // self.cell_size) + 1):
+                yield (i, j)
+
+    def copy(self):
+        grid = OccupancyGrid(self.cell_size)
+        grid.cells = {cell: list(areas) for cell, areas in self.cells.items()}
+        return grid
+
+    def add(self, bounding_box: Tuple[int, int, int, int]):
+        for cell in self._get_cells(bounding_box):
+            self.cells.setdefault(cell, []).append(bounding_box)
+
+    def get_overlapping(self, bounding_box: Tuple[int, int, int, int]):
+        overlapping = []
+        for cell in self._get_cells(bounding_box):
+            for area in self.cells.get(cell, ()):
+                if overlaps(area, bounding_box) and area not in overlapping:
+                    overlapping.append(area)
+        return overlapping
+
+    def find_space(self, bounding_box: Tuple[int, int, int, int], direction: FindSpaceDirection, max_steps = 1000):
+        """
+        Moves the bounding box in the direction until it no longer overlaps any known area.
+
+        :return: The free bounding box, or None if none was found within max_steps moves.
+        """
+        x, y, width, height = bounding_box
+        for _ in range(max_steps):
+            overlapping = self.get_overlapping((x, y, width, height))
+            if not overlapping:
+                return (int(x), int(y), int(width), int(height))
+
+            if direction == FindSpaceDirection.Right:
+                x = max(ax + aw for ax, _, aw, _ in overlapping)
+            else:
+                y = max(ay + ah for _, ay, _, ah in overlapping)
+
+        return None
@@ -0,0 +1,98 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from .database import connect
+
+class PlacementReservation:
+    def __init__(self, reserved_areas):
+        # Areas reserved by other uploaders that haven't expired yet
+        self.reserved_areas = reserved_areas
+        # Set to the area to reserve for our canvas
+        self.bounding_box = None
+
+class PlacementReservations:
+    """
+    Lets the uploaders on this machine, i.e. every A1111 instance sharing the
+    extension's data directory, place their canvases one at a time. The area
+    found for a canvas is reserved for a while, so the next uploader steers
+    clear of it even before the canvas shows up in the workspace.
+    """
+
+    def __init__(self, data_dir, ttl = 120):
+        self.db_file = os.path.join(data_dir, "placement_reservations.db")
+        self.ttl = ttl
+
+        with connect(self.db_file) as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS reservations (
+                    workspace_id TEXT NOT NULL,
+                    x REAL NOT NULL,
+                    y REAL NOT NULL,
+                    width REAL NOT NULL,
+                    height REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def reserve(self, workspace_id):
+        """
+        Holds the placement lock for the workspace until the block exits, and
+        reserves the bounding_box set on the yielded PlacementReservation.
+        """
+        # Placement waits on network calls, so give the other instances plenty of time
+        connection = sqlite3.connect(self.db_file, timeout = 120, isolation_level = None)
+        try:
+            # Takes the write lock right away, which is what serializes placement
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                connection.execute("DELETE FROM reservations WHERE expires_at < ?", (now,))
+                rows = connection.execute("SELECT x, y, width, height FROM reservations WHERE workspace_id = ?", (workspace_id,)).fetchall()
+
+                reservation = PlacementReservation([tuple(row) for row in rows])
+                yield reservation
+
+                if reservation.bounding_box is not None:
+                    x, y, width, height = reservation.bounding_box
+                    connection.execute("INSERT INTO reservations (workspace_id, x, y, width, height, expires_at) VALUES (?, ?, ?, ?, ?, ?)", (workspace_id, x, y, width, height, time.time() + self.ttl))
+
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    def move(self, workspace_id, bounding_box, new_bounding_box):
+        """
+        Moves the reservation of a canvas that had to be moved after it was placed.
+        """
+        x, y, width, height = bounding_box
+        new_x, new_y, new_width, new_height = new_bounding_box
+        with connect(self.db_file) as db:
+            db.execute("UPDATE reservations SET x = ?, y = ?, width = ?, height = ?, expires_at = ? WHERE workspace_id = ? AND x = ? AND y = ? AND width = ? AND height = ?", (new_x, new_y, new_width, new_height, time.time() + self.ttl, workspace_id, x, y, width, height))
@@ -0,0 +1,88 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import random
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from .config import Config
+
+class RetryPolicy:
+    """
+    Decides whether a failed request is retried and how long to wait before
+    the next attempt. Delays grow exponentially with full jitter, so that many
+    uploads failing at the same time do not retry in lockstep. Retry-After is
+    honoured when the server sends one.
+
+    Only idempotent requests are retried after server errors or timeouts. A
+    non-idempotent request (e.g. creating an element) is only retried when we
+    know the server did not act on it: a 429 or a failure to connect.
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_attempts = Config.retry_max_attempts, base_delay = Config.retry_base_delay, max_delay = Config.retry_max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry_response(self, response, attempt, idempotent):
+        if attempt >= self.max_attempts:
+            return False
+        if response.status_code == 429:
+            return True
+        return idempotent and response.status_code in self.retry_statuses
+
+    def should_retry_error(self, error, attempt, idempotent):
+        if attempt >= self.max_attempts:
+            return False
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        return idempotent and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def get_delay(self, attempt, response = None):
+        retry_after = self._get_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _get_retry_after(self, response):
+        if response is None:
+            return None
+
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+
+        # Either delay in seconds or an HTTP date
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+no_retries = RetryPolicy(max_attempts = 1)
@@ -0,0 +1,64 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import os
+import threading
+import weakref
+
+class SavedImages:
+    """
+    Keeps track of the files A1111 has saved the generated images to, so that the
+    saved file can be uploaded as is instead of encoding the same pixels again.
+    Images are tracked by identity, as A1111 saves the very same image objects that
+    end up in Processed.images, and forgotten once the image is garbage collected.
+    """
+
+    def __init__(self):
+        self.saved = {}
+        self.lock = threading.Lock()
+
+    def on_image_saved(self, params):
+        image = params.image
+        if image is None or not params.filename:
+            return
+
+        key = id(image)
+
+        def forget(ref):
+            with self.lock:
+                entry = self.saved.get(key)
+                if entry is not None and entry[0] is ref:
+                    del self.saved[key]
+
+        with self.lock:
+            self.saved[key] = (weakref.ref(image, forget), os.path.abspath(params.filename))
+
+    def get_path(self, image):
+        with self.lock:
+            entry = self.saved.get(id(image))
+
+        if entry is None or entry[0]() is not image:
+            return None
+
+        path = entry[1]
+        return path if os.path.exists(path) else None
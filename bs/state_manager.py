@@ -21,13 +21,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import atexit
 import json
 import os
-from .bluescape_api import bs_get_all_workspaces
+import threading
+from .workspace_cache import WorkspaceCache
+from .workspace_index import WorkspaceIndex
 from appdirs import AppDirs
 import subprocess
 from pathlib import Path
-from .misc import CanvasHeaderStrategy, CanvasTitleStrategy
+from .bluescape_api import bs_search_workspaces
+from .config import Config
+from .misc import CanvasHeaderStrategy, CanvasTitleStrategy, ImageEncoding, extract_workspace_id
 
 class StateManager:
 
@@ -38,11 +43,16 @@ class StateManager:
     workspace_dd = {}
     # Dictionary to lookup name by workspace id
     workspace_ids = {}
+    # Search index over the dropdown labels
+    workspace_index = WorkspaceIndex([])
 
     selected_workspace_id = ""
     enable_verbose = False
     img2img_include_init_images = True
     scale_to_standard_size = True
+    downscale_to_standard_size = False
+    background_upload = False
+    image_encoding = ImageEncoding.Png.value
     enable_metadata = True
     enable_analytics = True
     user_swimlane = True
@@ -67,9 +77,16 @@ class StateManager:
     def __init__(self):
         dirs = AppDirs("a1111-sd-extension", "Bluescape")
         os.makedirs(dirs.user_data_dir, exist_ok=True)
+        self.data_dir = dirs.user_data_dir
         self.state_file = os.path.join(dirs.user_data_dir, "bs_state.json")
+        self.workspace_cache = WorkspaceCache(dirs.user_data_dir)
         print("State file for your system: " + self.state_file)
 
+        # Pending write of the state file, see save()
+        self.save_timer = None
+        self.save_lock = threading.Lock()
+        atexit.register(self.flush)
+
     def read_versions(self, extension_file_path):
         if self.a1111_version != "unknown":
             return
@@ -94,24 +111,86 @@ class StateManager:
         self.workspace_ids = {}
         self.selected_workspace_id = ""
         self.token_exp = None
+        self.workspace_cache.clear()
         self.save()
 
-    def refresh_workspaces(self, token):
-        workspaces = bs_get_all_workspaces(token)
-        print(f"Total {len(workspaces)} workspaces retrieved")
-        self.workspace_ids = {}
-        self.workspace_dd = []
+    def refresh_workspaces(self, token, force = True):
+        """
+        :param force: Refresh the workspaces now. Otherwise the cached workspaces are used
+        right away, and refreshed in the background once they are stale.
+        """
+        cache = self.workspace_cache
+        if force or not cache.workspaces:
+            cache.refresh(token)
+        elif cache.is_stale():
+            cache.refresh_in_background(token, on_refreshed = self.on_workspaces_refreshed)
+
+        self.update_workspaces()
+        self.save()
+
+    def load_more_workspaces(self, token):
+        self.workspace_cache.load_more(token)
+        self.update_workspaces()
+        self.save()
 
-        for w in workspaces:
+    def on_workspaces_refreshed(self):
+        self.update_workspaces()
+        self.save()
+
+    def update_workspaces(self):
+        workspace_ids = {}
+        workspace_dd = []
+
+        for w in self.workspace_cache.workspaces:
             dd_name = f"{w['name']} ({w['id']})"
-            self.workspace_ids[w['id']] = dd_name
-            self.workspace_dd.append(dd_name)
+            workspace_ids[w['id']] = dd_name
+            workspace_dd.append(dd_name)
+
+        # Keep the selected workspace, even if it was on a page that isn't loaded anymore
+        selected_workspace = self.workspace_ids.get(self.selected_workspace_id)
+        if self.selected_workspace_id not in workspace_ids and selected_workspace is not None:
+            workspace_ids[self.selected_workspace_id] = selected_workspace
+            workspace_dd.append(selected_workspace)
+
+        self.workspace_ids = workspace_ids
+        self.workspace_dd = workspace_dd
+        self.workspace_index = WorkspaceIndex(workspace_dd)
 
         # If we don't have an existing selected id, lets select the first one
         if self.selected_workspace_id == "" or self.selected_workspace_id not in self.workspace_ids.keys():
-            self.selected_workspace_id = next(iter(self.workspace_ids))
+            self.selected_workspace_id = next(iter(self.workspace_ids), "")
 
-        self.save()
+    def search_workspaces(self, query, token = None):
+        """
+        Searches the loaded workspaces. If there are more workspaces to load and the
+        token is given, Bluescape is searched as well when there aren't enough matches.
+
+        :return: The best matching dropdown labels, always including the selected workspace.
+        """
+        limit = Config.workspace_search_results
+        matches = self.workspace_index.search(query, limit)
+
+        if token and len(matches) < limit and self.workspace_cache.has_more() and len(query.strip()) >= 3:
+            for w in bs_search_workspaces(token, query.strip(), limit):
+                dd_name = f"{w['name']} ({w['id']})"
+                # Remember it, so it can be selected
+                self.workspace_ids[w['id']] = dd_name
+                if dd_name not in matches:
+                    matches.append(dd_name)
+            matches = matches[:limit]
+
+        selected_workspace = self.get_selected_workspace_item()
+        if selected_workspace is not None and selected_workspace not in matches:
+            matches.append(selected_workspace)
+
+        return matches
+
+    def get_workspace_id_by_item(self, item):
+        for workspace_id, dd_name in self.workspace_ids.items():
+            if dd_name == item:
+                return workspace_id
+
+        return extract_workspace_id(item)
 
     def get_selected_workspace_item(self):
         selected_workspace = None
@@ -121,31 +200,64 @@ class StateManager:
         return selected_workspace
 
     def save(self):
-        with open(self.state_file, "w+") as out_file:
-            json.dump({
-                "user_id": self.user_id,
-                "user_name": self.user_name,
-                "selected_workspace_id": self.selected_workspace_id,
-                "enable_verbose": self.enable_verbose,
-                "img2img_include_init_images": self.img2img_include_init_images,
-                "img2img_include_mask_image": self.img2img_include_mask_image,
-                "scale_to_standard_size": self.scale_to_standard_size,
-                "enable_metadata": self.enable_metadata,
-                "enable_analytics": self.enable_analytics,
-                "user_swimlane": self.user_swimlane,
-                "use_canvas_border_color": self.use_canvas_border_color,
-                "canvas_border_color": self.canvas_border_color,
-                "workspace_dd": self.workspace_dd,
-                "workspace_ids": self.workspace_ids,
-                "canvas_title_strategy": self.canvas_title_strategy,
-                "canvas_header_strategy": self.canvas_header_strategy,
-                "nick_name": self.nick_name,
-                "user_token": self.user_token,
-                "token_exp": self.token_exp
-            }, out_file, indent = 6)
-            out_file.close()
+        """
+        Schedules writing the state file. Changes made within a short window of each
+        other, e.g. while clicking through the settings, are written together.
+        """
+        with self.save_lock:
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(Config.state_save_delay, self.flush)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def flush(self):
+        """
+        Writes any pending changes to the state file right away.
+        """
+        with self.save_lock:
+            if self.save_timer is None:
+                return
+            self.save_timer.cancel()
+            self.save_timer = None
+
+            # Written to a temporary file first, so a crash while writing never
+            # leaves a corrupt state file behind
+            temp_file = f"{self.state_file}.tmp"
+            with open(temp_file, "w") as out_file:
+                json.dump(self.get_state_data(), out_file, indent = 6)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.replace(temp_file, self.state_file)
+
+    def get_state_data(self):
+        # The workspaces are kept in the workspace cache, apart from the settings
+        return {
+            "user_id": self.user_id,
+            "user_name": self.user_name,
+            "selected_workspace_id": self.selected_workspace_id,
+            "selected_workspace_item": self.get_selected_workspace_item(),
+            "enable_verbose": self.enable_verbose,
+            "img2img_include_init_images": self.img2img_include_init_images,
+            "img2img_include_mask_image": self.img2img_include_mask_image,
+            "scale_to_standard_size": self.scale_to_standard_size,
+            "downscale_to_standard_size": self.downscale_to_standard_size,
+            "background_upload": self.background_upload,
+            "image_encoding": self.image_encoding,
+            "enable_metadata": self.enable_metadata,
+            "enable_analytics": self.enable_analytics,
+            "user_swimlane": self.user_swimlane,
+            "use_canvas_border_color": self.use_canvas_border_color,
+            "canvas_border_color": self.canvas_border_color,
+            "canvas_title_strategy": self.canvas_title_strategy,
+            "canvas_header_strategy": self.canvas_header_strategy,
+            "nick_name": self.nick_name,
+            "user_token": self.user_token,
+            "token_exp": self.token_exp
+        }
 
     def load(self):
+        self.workspace_cache.load()
+
         if not os.path.exists(self.state_file):
             return
 
@@ -166,8 +278,6 @@ class StateManager:
                     self.canvas_header_strategy = data['canvas_header_strategy'] if data['canvas_header_strategy'] else CanvasHeaderStrategy.Default.value
                     self.use_canvas_border_color = data['use_canvas_border_color']
                     self.canvas_border_color = data['canvas_border_color'] if data["canvas_border_color"] else None
-                    self.workspace_dd = data['workspace_dd']
-                    self.workspace_ids = data['workspace_ids']
                     self.nick_name = data['nick_name'] if data['nick_name'] else None
                     self.user_token = data['user_token']
                 except KeyError:
@@ -175,9 +285,24 @@ class StateManager:
 
                 self.user_name = self.read_from_json(data, "user_name", "")
                 self.token_exp = self.read_from_json(data, "token_exp", None)
+                self.downscale_to_standard_size = self.read_from_json(data, "downscale_to_standard_size", False)
+                self.background_upload = self.read_from_json(data, "background_upload", False)
+                self.image_encoding = self.read_from_json(data, "image_encoding", ImageEncoding.Png.value)
+                # Older versions kept the workspaces in the state file
+                self.workspace_dd = self.read_from_json(data, "workspace_dd", [])
+                self.workspace_ids = self.read_from_json(data, "workspace_ids", {})
+                selected_workspace_item = self.read_from_json(data, "selected_workspace_item", None)
+                if selected_workspace_item and self.selected_workspace_id not in self.workspace_ids:
+                    self.workspace_ids[self.selected_workspace_id] = selected_workspace_item
 
                 f.close()
 
+            # The workspace cache is kept more up to date than the state file
+            if self.workspace_cache.workspaces:
+                self.update_workspaces()
+            else:
+                self.workspace_index = WorkspaceIndex(self.workspace_dd)
+
         except json.JSONDecodeError:
             print("JSONDecode Error")
             return
@@ -0,0 +1,99 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import asyncio
+import threading
+
+class StatusChannel:
+    """
+    The latest status shown in the browser, with a version that is bumped on every
+    change. Streaming and long-polling clients wait on the channel, and are woken
+    up only when the status actually changes.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.status = None
+        self.lock = threading.Lock()
+        # (event loop, asyncio.Event) of every waiting client
+        self.subscribers = set()
+
+    def publish(self, status):
+        with self.lock:
+            if status == self.status:
+                return
+            self.status = status
+            self.version += 1
+            subscribers = list(self.subscribers)
+
+        # Statuses are published from the upload threads, the clients wait on the server event loop
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has been closed
+                pass
+
+    def get(self):
+        with self.lock:
+            return self.version, self.status
+
+    async def wait_for_change(self, version, timeout):
+        """
+        Waits until the version differs from the given one, or the timeout passes.
+
+        :return: The current version and status.
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+
+        with self.lock:
+            self.subscribers.add(subscriber)
+            changed = self.version != version
+
+        try:
+            if not changed:
+                await asyncio.wait_for(subscriber[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
+
+        return self.get()
+
+class UncompressedPathsMiddleware:
+    """
+    ASGI middleware that removes Accept-Encoding from requests for the given paths.
+    A1111 adds a GZipMiddleware that doesn't flush streamed responses, which holds
+    back the events of the status stream until the connection closes.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            scope = dict(scope)
+            scope["headers"] = [(name, value) for name, value in scope["headers"] if name.lower() != b"accept-encoding"]
+        await self.app(scope, receive, send)
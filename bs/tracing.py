@@ -0,0 +1,307 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from .config import Config
+
+class Trace:
+    """
+    The spans recorded for one upload. The trace id is derived from the upload id,
+    so the spans of every attempt at an upload end up in the same trace.
+    """
+
+    def __init__(self, upload_id = None):
+        self.upload_id = upload_id
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def get_trace_id(self):
+        try:
+            return uuid.UUID(self.upload_id).hex
+        except (TypeError, ValueError):
+            if not hasattr(self, "random_trace_id"):
+                self.random_trace_id = uuid.uuid4().hex
+            return self.random_trace_id
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def get_children(self, parent):
+        with self.lock:
+            return [span for span in self.spans if span.parent is parent]
+
+class Span:
+    def __init__(self, trace: Trace, name, parent = None, attributes = None):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time_ns()
+        self.end_time = None
+        # "ok", the name of the exception the span ended with, or an outcome set by the caller
+        self.outcome = "ok"
+        self.token = None
+
+    def get_duration(self):
+        """
+        :return: The duration in seconds, up to now if the span hasn't ended yet.
+        """
+        return ((self.end_time or time.time_ns()) - self.start_time) / 1e9
+
+    def to_otlp(self):
+        attributes = dict(self.attributes)
+        if self.trace.upload_id is not None:
+            attributes["upload_id"] = self.trace.upload_id
+        attributes["outcome"] = self.outcome
+
+        span = {
+            "traceId": self.trace.get_trace_id(),
+            "spanId": self.span_id,
+            "name": self.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time or time.time_ns()),
+            "attributes": [{"key": key, "value": get_otlp_value(value)} for key, value in attributes.items()],
+            # STATUS_CODE_OK or STATUS_CODE_ERROR
+            "status": {"code": 1} if self.outcome in ("ok", "complete") else {"code": 2, "message": self.outcome}
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+def get_otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+current_span = contextvars.ContextVar("bluescape_span", default = None)
+
+def start_span(name, **attributes):
+    """
+    Starts a span as a child of the current span, and makes it the current span.
+
+    :return: The span, or None when no trace is being recorded.
+    """
+    parent = current_span.get()
+    if parent is None:
+        return None
+
+    span = Span(parent.trace, name, parent, attributes)
+    parent.trace.add(span)
+    span.token = current_span.set(span)
+    return span
+
+def end_span(span, outcome = None):
+    """
+    Ends the span, and any of its descendants left open by an early return or an
+    exception, which take the outcome of the span.
+    """
+    if span is None or span.end_time is not None:
+        return
+    if outcome is not None:
+        span.outcome = outcome
+
+    with span.trace.lock:
+        open_spans = [other for other in span.trace.spans if other.end_time is None and other is not span and is_descendant(other, span)]
+    for other in open_spans:
+        other.end_time = time.time_ns()
+        other.outcome = span.outcome
+        other.token = None
+
+    span.end_time = time.time_ns()
+    if span.token is not None:
+        current_span.reset(span.token)
+        span.token = None
+
+def is_descendant(span, ancestor):
+    parent = span.parent
+    while parent is not None:
+        if parent is ancestor:
+            return True
+        parent = parent.parent
+    return False
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Records the with block as a span of the current trace, if there is one.
+    """
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        end_span(current, type(e).__name__)
+        raise
+    end_span(current)
+
+@contextmanager
+def trace(name, upload_id = None, **attributes):
+    """
+    Starts a new trace with the with block as its root span, which is exported when
+    the block exits. Within an existing trace, it is recorded as a span of that trace.
+    """
+    if current_span.get() is not None:
+        with span(name, **attributes) as child:
+            if upload_id is not None:
+                child.trace.upload_id = upload_id
+            yield child
+        return
+
+    root = Span(Trace(upload_id), name, None, attributes)
+    root.trace.add(root)
+    root.token = current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        end_span(root, type(e).__name__)
+        raise
+    finally:
+        end_span(root)
+        export(root.trace)
+
+def traced(name = None):
+    """
+    Decorator recording the calls of a function as spans of the current trace, if there is one.
+    """
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def set_upload_id(upload_id):
+    """
+    Tags the current trace with the upload id, once it is known.
+    """
+    current = current_span.get()
+    if current is not None:
+        current.trace.upload_id = upload_id
+
+def propagate(fn):
+    """
+    Wraps fn so that spans it records on a pool thread belong to the current span.
+    """
+    parent = current_span.get()
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_span.reset(token)
+
+    return wrapper
+
+def get_summary(parent):
+    """
+    :return: A one line summary of the time spent in the children of the span, for example
+    "placement 420ms, canvas 180ms, texts 310ms, images 3.1s, total 4.0s".
+    """
+    durations = {}
+    for child in parent.trace.get_children(parent):
+        durations[child.name] = durations.get(child.name, 0) + child.get_duration()
+
+    parts = [f"{name} {format_duration(duration)}" for name, duration in durations.items()]
+    parts.append(f"total {format_duration(parent.get_duration())}")
+    return ", ".join(parts)
+
+def format_duration(seconds):
+    if seconds < 1:
+        return f"{round(seconds * 1000)}ms"
+    return f"{seconds:.1f}s"
+
+def to_otlp(trace: Trace):
+    """
+    :return: The trace in the OpenTelemetry (OTLP) JSON format.
+    """
+    with trace.lock:
+        spans = list(trace.spans)
+
+    return {
+        "resourceSpans": [{
+            "resource": {
+                "attributes": [{"key": "service.name", "value": {"stringValue": Config.trace_service_name}}]
+            },
+            "scopeSpans": [{
+                "scope": {"name": "sd-webui-bluescape"},
+                "spans": [span.to_otlp() for span in spans]
+            }]
+        }]
+    }
+
+# A single thread, so traces are written to the file in order and the upload isn't held up
+export_pool = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "bluescape-trace")
+file_lock = threading.Lock()
+
+def export(trace: Trace):
+    if not Config.trace_file and not Config.trace_collector_url:
+        return
+    data = to_otlp(trace)
+    export_pool.submit(export_now, data)
+
+def export_now(data):
+    if Config.trace_file:
+        try:
+            with file_lock:
+                directory = os.path.dirname(Config.trace_file)
+                if directory:
+                    os.makedirs(directory, exist_ok = True)
+                with open(Config.trace_file, "a") as f:
+                    f.write(json.dumps(data) + "\n")
+        except OSError as e:
+            print(f"Could not write trace to {Config.trace_file}: {e}")
+
+    if Config.trace_collector_url:
+        # Imported here, as the HTTP client itself is instrumented
+        from .http_client import http_client
+        try:
+            response = http_client.post(Config.trace_collector_url, json = data, timeout = 10)
+            if response.status_code >= 300:
+                print(f"Trace collector returned {response.status_code}: {response.text[:200]}")
+        except Exception as e:
+            print(f"Could not send trace to {Config.trace_collector_url}: {e}")
@@ -0,0 +1,510 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+from enum import Enum
+import random
+import time
+import traceback
+import requests
+from .expired_token_exception import ExpiredTokenException
+from .bluescape_api_exception import BluescapeApiException
+from .config import Config
+from .bluescape_api import extended_data_body, generation_data_body, generation_label_body, label_body, seed_body, top_title_body
+from .misc import FindSpaceDirection
+from .image_encoder import get_image_format
+from .memory_budget import MemoryBudget
+from .occupancy_grid import OccupancyGrid, overlaps
+from .upload_job import UploadJob
+from . import tracing
+
+class UploadOutcome(Enum):
+    Complete = "Complete"
+    # Bluescape could not be reached or the token expired, the job can be tried again later
+    Retry = "Retry"
+    Failed = "Failed"
+
+def run_upload_job(manager, job: UploadJob, spool = None, can_retry = True) -> UploadOutcome:
+    """
+    Places the canvas for the job, and creates the canvas, text elements and images in it.
+    The attempt is recorded as an "upload" span, with a span per phase.
+
+    :param spool: Optional UploadSpool the job is stored in. Completed elements are recorded
+    there, and elements recorded by an earlier attempt are not created again.
+    :param can_retry: Whether the caller tries the job again after a Retry outcome. If not,
+    the job is finished as failed rather than retrying.
+    """
+    with tracing.trace("upload", upload_id = job.upload_id) as upload_span:
+        outcome = attempt_upload_job(manager, job, spool, upload_span, can_retry)
+        upload_span.outcome = outcome.value.lower()
+        return outcome
+
+def attempt_upload_job(manager, job: UploadJob, spool, upload_span, can_retry) -> UploadOutcome:
+
+    upload_id = job.upload_id
+    is_txt2img = job.is_txt2img
+    generation_type = job.generation_type
+    user_id = job.user_id
+    num_images = job.get_num_images()
+    image_size = job.image_size
+    workspace_id = job.workspace_id
+
+    # Elements already created by an earlier attempt of this job
+    done = spool.get_done(upload_id) if spool is not None else {}
+
+    def mark_done(element_key, value):
+        if spool is not None:
+            spool.mark_done(upload_id, element_key, value)
+
+    jobs = manager.job_registry
+    retry_phase = "retrying" if can_retry else "failed"
+
+    # Errors of single texts and images, recorded with the element as they happen
+    element_errors = []
+
+    def element_failed(element, error):
+        element_errors.append(error)
+        jobs.add_error(upload_id, error, element)
+
+    def add_error(error):
+        # The error a batch raises has been recorded with its element already
+        if not any(error is element_error for element_error in element_errors):
+            jobs.add_error(upload_id, error)
+    jobs.start(job, images_done = len([key for key in done if key.startswith("image:")]))
+
+    phase_span = None
+    def enter_phase(phase):
+        nonlocal phase_span
+        tracing.end_span(phase_span)
+        phase_span = tracing.start_span(phase) if phase is not None else None
+        if phase is not None:
+            jobs.update(upload_id, phase = phase)
+
+    # Uploads the UI state
+    manager.set_status("Preparing...", is_txt2img)
+
+    # Lets calculate the layout
+    layout = job.create_layout()
+    # How much space we need
+    canvas_bounding_box = layout.get_canvas_bounding_box()
+
+    # We'll use this for padding between the swimlanes, if necessary
+    canvas_y_padding = 1500
+
+    try:
+        enter_phase("placement")
+        if "placement" in done:
+            available_canvas_bounding_box = tuple(done["placement"])
+            print(f"Resuming upload at canvas location: {str(available_canvas_bounding_box)} - (upload_id: {upload_id})")
+        else:
+            # Hold the placement lock while looking for space, so other uploaders on this
+            # machine don't pick the same space before our canvas exists
+            with manager.placement_reservations.reserve(workspace_id) as reservation:
+                available_canvas_bounding_box = find_canvas_location(manager, job, canvas_bounding_box, canvas_y_padding, reservation.reserved_areas)
+                reservation.bounding_box = available_canvas_bounding_box
+
+            mark_done("placement", available_canvas_bounding_box)
+
+        # Move layout to target that
+        layout.translate(available_canvas_bounding_box)
+        enter_phase("canvas")
+
+        # Create canvas
+        if "canvas" in done:
+            canvas_id = done["canvas"]
+        else:
+            canvas_id = manager.create_canvas_at(job.canvas_title, available_canvas_bounding_box, job.canvas_traits, job.canvas_color, workspace_id = workspace_id)
+
+            if Config.verify_placement:
+                canvas_id, verified_bounding_box = verify_canvas_location(manager, job, canvas_id, available_canvas_bounding_box)
+                if verified_bounding_box != available_canvas_bounding_box:
+                    # Keep the other uploaders on this machine clear of where the canvas is now
+                    manager.placement_reservations.move(workspace_id, available_canvas_bounding_box, verified_bounding_box)
+                    available_canvas_bounding_box = verified_bounding_box
+                    mark_done("placement", available_canvas_bounding_box)
+                    layout.translate(available_canvas_bounding_box)
+
+            mark_done("canvas", canvas_id)
+
+        jobs.update(upload_id, canvas_id = canvas_id, link = f"{Config.client_base_domain}/applink/{workspace_id}?objectId={canvas_id}")
+
+        # None of the text elements depend on each other, so we'll collect
+        # them all and create them in one go
+        text_bodies = []
+
+        # Create title inside the canvas
+        top_title_location = layout.get_top_title_location()
+        text_bodies.append(top_title_body(top_title_location, job.top_title, job.header))
+
+        # Create generation data section regardless
+        infotext_location = layout.get_infotext_location()
+        text_bodies.append(generation_data_body(infotext_location, job.infotext))
+        infotext_label_location = layout.get_infotext_label_location()
+        text_bodies.append(generation_label_body(infotext_label_location, f"Generation data ({generation_type}):"))
+
+        # Create extended data section only if verbose_mode enabled
+        if (job.enable_verbose):
+            bottom_small_infobar_location = layout.get_bottom_infobar_location()
+            text_bodies.append(extended_data_body(bottom_small_infobar_location, job.extended_generation_data))
+            infotext_label_location = layout.get_extended_generation_data_label_location()
+            text_bodies.append(generation_label_body(infotext_label_location, f"Extended generation data:"))
+
+        # Get image coordinates
+        image_layout = layout.get_image_grid_layout()
+        # Get seed / label coordinates
+        label_layout = layout.get_label_grid_layout()
+
+        for i, upload_image in enumerate(job.images):
+            label_x, label_y = label_layout[i]
+            label_width = image_size[0]
+            label_height = 50
+            label_location = (label_x, label_y, label_width, label_height)
+
+            if upload_image.kind == "source_image":
+                text_bodies.append(label_body(label_location, "Source image"))
+            elif upload_image.kind == "image_mask":
+                text_bodies.append(label_body(label_location, "Image mask"))
+            else:
+                text_bodies.append(seed_body(label_location, upload_image.seed, upload_image.subseed))
+
+        manager.set_status("Creating generation data...", is_txt2img)
+        enter_phase("texts")
+        pending_texts = [i for i in range(len(text_bodies)) if f"text:{i}" not in done]
+
+        def on_created(index, element_id):
+            mark_done(f"text:{pending_texts[index]}", element_id)
+
+        def on_text_failed(index, error):
+            element_failed(f"text:{pending_texts[index]}", error)
+
+        manager.create_text_elements([text_bodies[i] for i in pending_texts], on_created, workspace_id = workspace_id, on_failed = on_text_failed)
+
+        # Source images, the mask and the generated images share the same grid,
+        # in the order they were added to the job
+        pending_images = [i for i in range(num_images) if f"image:{i}" not in done]
+        enter_phase("images")
+
+        # Source images and masks that are already in the workspace don't need to be uploaded again
+        for i in copy_existing_images(manager, job, pending_images, image_layout, mark_done):
+            pending_images.remove(i)
+            jobs.image_uploaded(upload_id, 0)
+
+        # Images are encoded just in time for their upload and released right after,
+        # so memory use stays within the budget regardless of the size of the batch
+        budget = MemoryBudget(Config.upload_memory_budget_mb * 1024 * 1024)
+
+        # The data of each upload, by upload index, to tell how many bytes were sent
+        pending_datas = []
+
+        def get_uploads():
+            for i in pending_images:
+                upload_image = job.images[i]
+                x, y = image_layout[i]
+                width, height = image_size
+
+                pending_data = upload_image.get_pending_data(job.image_encoding, job.max_upload_size, budget)
+                pending_datas.append(pending_data)
+                yield (pending_data, upload_image.filename, (x, y, width, height), upload_image.traits)
+
+        num_uploaded = num_images - len(pending_images)
+        manager.set_status(f"Uploading images: {num_uploaded} / {num_images}", is_txt2img)
+
+        uploaded = []
+        def on_uploaded(index, element_id):
+            i = pending_images[index]
+            mark_done(f"image:{i}", element_id)
+            if job.images[i].content_hash and element_id:
+                manager.asset_index.add(workspace_id, job.images[i].content_hash, element_id)
+            uploaded.append(i)
+            jobs.image_uploaded(upload_id, pending_datas[index].size)
+            manager.set_status(f"Uploading images: {num_uploaded + len(uploaded)} / {num_images}", is_txt2img)
+            print(f"Image {job.images[i].filename} has been uploaded to Bluescape - (upload_id: {upload_id})")
+
+        def on_image_failed(index, error):
+            element_failed(job.images[pending_images[index]].filename, error)
+
+        manager.upload_images_at(get_uploads(), on_uploaded, workspace_id = workspace_id, image_format = get_image_format(job.image_encoding), on_failed = on_image_failed)
+        enter_phase(None)
+        timing = tracing.get_summary(upload_span)
+
+        # Provide a link to the canvas back to the UI
+        state = manager.state
+        link_to_canvas = f"{Config.client_base_domain}/applink/{workspace_id}?objectId={canvas_id}"
+        manager.set_status(f"Upload complete ({timing}) - <a href='{link_to_canvas}' target='_blank'>Click here to open workspace</a>", is_txt2img)
+
+        # Analytics
+        manager.analytics.send_uploaded_generated_images_event(state.user_token, workspace_id, num_images, state.user_id)
+
+        print(f"Upload complete ({timing}) - (upload_id: {upload_id})")
+        jobs.finish(upload_id, "complete")
+        return UploadOutcome.Complete
+    except ExpiredTokenException:
+        manager.state.token_expired = True
+        jobs.add_error(upload_id, "Access to Bluescape has expired")
+        jobs.finish(upload_id, retry_phase)
+        return UploadOutcome.Retry
+    except BluescapeApiException as e:
+        print(f"Upload failed - (upload_id: {upload_id})")
+        print(e)
+        manager.set_status(f"Upload failed (status {e.status_code}), see console for details", is_txt2img)
+        add_error(e)
+        # Server side trouble may well pass, anything else won't
+        if e.status_code == 429 or e.status_code >= 500:
+            jobs.finish(upload_id, retry_phase)
+            return UploadOutcome.Retry
+        jobs.finish(upload_id, "failed")
+        return UploadOutcome.Failed
+    except requests.exceptions.RequestException as e:
+        print(f"Bluescape could not be reached - (upload_id: {upload_id})")
+        print(e)
+        manager.set_status("Bluescape could not be reached, see console for details", is_txt2img)
+        add_error(e)
+        jobs.finish(upload_id, retry_phase)
+        return UploadOutcome.Retry
+    except Exception as e:
+        # Anything else, like a spooled image file that is gone, won't pass by trying again
+        print(f"Upload failed unexpectedly - (upload_id: {upload_id})")
+        traceback.print_exc()
+        manager.set_status("Upload failed, see console for details", is_txt2img)
+        add_error(e)
+        jobs.finish(upload_id, "failed")
+        return UploadOutcome.Failed
+
+def find_canvas_location(manager, job: UploadJob, canvas_bounding_box, canvas_y_padding, reserved_areas = ()):
+    """
+    Finds space for the canvas, next to the latest canvas created with the extension.
+
+    :param reserved_areas: Areas other uploaders are about to create canvases in.
+    :return: The bounding box for the canvas.
+    """
+
+    upload_id = job.upload_id
+    user_id = job.user_id
+    workspace_id = job.workspace_id
+
+    # Default to going "Right"
+    direction = FindSpaceDirection.Right
+
+    # Ok, now lets see where to place this.
+
+    # First, lets look at the existing Canvases in the workspace
+    is_enough = None
+    if Config.canvas_listing_order:
+        # The listing is newest first, so we can stop at the first canvas we'd aim for
+        swimlane_user_id = user_id if job.user_swimlane else None
+        # Checked as pages load, as the order is dropped if the server rejects it
+        is_enough = lambda canvases: bool(Config.canvas_listing_order) and canvases.get_latest_canvas(swimlane_user_id) is not None
+
+    workspace_canvases = manager.get_workspace_canvases(workspace_id = workspace_id, is_enough = is_enough)
+    if workspace_canvases.get_canvas_count() > 0:
+        # Let's look for the canvases that are generated by our extension
+        if workspace_canvases.get_latest_canvas() is not None:
+            if job.user_swimlane:
+                # If the user has selected user_swimlane option, then we need to
+                # check whether the user has previously created a canvas in this workspace
+                # with the extension and aim for the latest one.
+                latest_canvas = workspace_canvases.get_latest_canvas(user_id)
+                if latest_canvas is not None:
+                    canvas_bounding_box = (latest_canvas.x, latest_canvas.y, canvas_bounding_box[2], canvas_bounding_box[3])
+                    print(f"Existing user canvas found - going RIGHT from there - (upload_id: {upload_id})")
+                else:
+                    # If no existing canvas found for this user, lets start from
+                    # 0,0, but go down to find a start for this user's swimlane
+                    print(f"No existing user canvas found - going DOWN from origin - (upload_id: {upload_id})")
+                    direction = FindSpaceDirection.Down
+            else:
+                # Otherwise check if anybody has created a generation canvas
+                # in this workspace and aim for the latest one.
+                latest_canvas = workspace_canvases.get_latest_canvas()
+                canvas_bounding_box = (latest_canvas.x, latest_canvas.y, canvas_bounding_box[2], canvas_bounding_box[3])
+                print(f"Existing extension canvas found - going RIGHT from there - (upload_id: {upload_id})")
+        else:
+            # If nobody has done it, we'll start from 0,0, but go down to
+            # find space for a shared swimlane
+            print(f"No extension canvas found - going DOWN from origin - (upload_id: {upload_id})")
+            direction = FindSpaceDirection.Down
+
+    else:
+        print(f"No canvas found - going DOWN from origin - (upload_id: {upload_id})")
+        direction = FindSpaceDirection.Down
+
+    available_canvas_bounding_box = None
+
+    # Bluescape doesn't know about the reservations, so they are treated as occupied here
+    reserved = OccupancyGrid()
+    for area in reserved_areas:
+        reserved.add(area)
+
+    if Config.local_placement:
+        # Propose the space from the canvases we know about and the reserved areas,
+        # Bluescape only needs to confirm nothing else is in the way
+        occupancy = workspace_canvases.occupancy
+        if reserved_areas:
+            occupancy = occupancy.copy()
+            for area in reserved_areas:
+                occupancy.add(area)
+
+        proposed_bounding_box = propose_space(occupancy, canvas_bounding_box, direction, canvas_y_padding)
+        if proposed_bounding_box is not None:
+            confirmed_bounding_box = tuple(manager.find_space(proposed_bounding_box, direction.value, workspace_id = workspace_id))
+            if confirmed_bounding_box == proposed_bounding_box:
+                print(f"Proposed canvas location confirmed - (upload_id: {upload_id})")
+                available_canvas_bounding_box = proposed_bounding_box
+            elif direction == FindSpaceDirection.Right:
+                # Bluescape searched right from the proposed location, so it found free space already
+                print(f"Proposed canvas location not available - using the space found next to it - (upload_id: {upload_id})")
+                available_canvas_bounding_box = confirmed_bounding_box
+            else:
+                # Going down the swimlane padding has to be added to wherever the space is
+                print(f"Proposed canvas location not available - searching for space - (upload_id: {upload_id})")
+
+    if available_canvas_bounding_box is None:
+        # Find available space for us
+        available_canvas_bounding_box = manager.find_space(canvas_bounding_box, direction.value, workspace_id = workspace_id)
+
+        if direction == FindSpaceDirection.Down and available_canvas_bounding_box[1] != 0:
+            # Looks like there wasn't space at 0,0, but found space further down. However,
+            # let's add some padding to make the swimlane clear.
+            new_bounding_box = (available_canvas_bounding_box[0], available_canvas_bounding_box[1] + canvas_y_padding, available_canvas_bounding_box[2], available_canvas_bounding_box[3])
+            print(f"Adjusting canvas location further to add padding - (upload_id: {upload_id})")
+            available_canvas_bounding_box = manager.find_space(new_bounding_box, direction.value, workspace_id = workspace_id)
+
+    # Whichever way the space was found, step past any reserved area we landed on. Each step
+    # goes right of at least one of them, so there are never more steps than reserved areas.
+    for _ in range(len(reserved_areas)):
+        overlapping = reserved.get_overlapping(available_canvas_bounding_box)
+        if not overlapping:
+            break
+        new_x = max(x + width for x, _, width, _ in overlapping)
+        new_bounding_box = (new_x, available_canvas_bounding_box[1], available_canvas_bounding_box[2], available_canvas_bounding_box[3])
+        print(f"Canvas location reserved by another upload - going RIGHT from there - (upload_id: {upload_id})")
+        available_canvas_bounding_box = manager.find_space(new_bounding_box, FindSpaceDirection.Right.value, workspace_id = workspace_id)
+
+    if reserved.get_overlapping(available_canvas_bounding_box):
+        # Bluescape kept pointing us back at reserved areas
+        print(f"Canvas location still overlaps an area reserved by another upload, placing it there anyway - (upload_id: {upload_id})")
+
+    # We found space here
+    print(f"Target canvas location found: {str(available_canvas_bounding_box)} - (upload_id: {upload_id})")
+
+    return available_canvas_bounding_box
+
+def verify_canvas_location(manager, job: UploadJob, canvas_id, canvas_bounding_box):
+    """
+    Checks the canvas doesn't overlap a canvas created by another uploader at the same time,
+    and moves it if it does. Of two overlapping canvases the one with the higher id moves,
+    so both uploaders agree on which one that is.
+
+    :return: The id and bounding box of the canvas.
+    """
+
+    upload_id = job.upload_id
+    workspace_id = job.workspace_id
+
+    for attempt in range(Config.placement_verify_attempts):
+        # Give the uploaders racing us a moment to create their canvases
+        time.sleep(Config.placement_verify_delay * (2 ** attempt) * random.uniform(0.5, 1.0))
+
+        workspace_canvases = manager.get_workspace_canvases(workspace_id = workspace_id, refresh = True)
+        other_canvases = [canvas for canvas in workspace_canvases.canvases if canvas.id != canvas_id]
+        conflicting_canvases = [canvas for canvas in other_canvases if canvas.id and canvas.id < canvas_id and overlaps((canvas.x, canvas.y, canvas.width, canvas.height), canvas_bounding_box)]
+
+        if not conflicting_canvases:
+            return canvas_id, canvas_bounding_box
+
+        print(f"Canvas overlaps a canvas created at the same time - moving it - (upload_id: {upload_id})")
+
+        occupancy = OccupancyGrid()
+        for canvas in other_canvases:
+            occupancy.add((canvas.x, canvas.y, canvas.width, canvas.height))
+
+        proposed_bounding_box = occupancy.find_space(canvas_bounding_box, FindSpaceDirection.Right) or canvas_bounding_box
+        new_bounding_box = manager.find_space(proposed_bounding_box, FindSpaceDirection.Right.value, workspace_id = workspace_id)
+
+        manager.delete_element(canvas_id, workspace_id = workspace_id)
+        canvas_id = manager.create_canvas_at(job.canvas_title, new_bounding_box, job.canvas_traits, job.canvas_color, workspace_id = workspace_id)
+        canvas_bounding_box = new_bounding_box
+
+        print(f"Canvas moved to: {str(canvas_bounding_box)} - (upload_id: {upload_id})")
+
+    return canvas_id, canvas_bounding_box
+
+def propose_space(occupancy: OccupancyGrid, bounding_box, direction: FindSpaceDirection, y_padding):
+    """
+    Finds space for the canvas locally, the same way we'd search for it with Bluescape.
+
+    :return: The proposed bounding box, or None if no space was found.
+    """
+    proposed_bounding_box = occupancy.find_space(bounding_box, direction)
+
+    if proposed_bounding_box is not None and direction == FindSpaceDirection.Down and proposed_bounding_box[1] != 0:
+        padded_bounding_box = (proposed_bounding_box[0], proposed_bounding_box[1] + y_padding, proposed_bounding_box[2], proposed_bounding_box[3])
+        proposed_bounding_box = occupancy.find_space(padded_bounding_box, direction)
+
+    return proposed_bounding_box
+
+def copy_existing_images(manager, job: UploadJob, pending_images, image_layout, mark_done):
+    """
+    Copies the images of the job that have been uploaded to the workspace before.
+
+    :return: The indices of the images that were copied.
+    """
+
+    workspace_id = job.workspace_id
+    # Already done for spooled jobs, before their images were encoded
+    job.hash_source_images()
+    candidates = [i for i in pending_images if job.images[i].content_hash]
+    if not candidates:
+        return []
+
+    index = manager.asset_index
+    if not index.is_scanned(workspace_id):
+        # Our local index may have been cleared, so rebuild it from the workspace once,
+        # only marking it scanned once every page has been read
+        image_hashes, cursor = manager.get_existing_images(workspace_id = workspace_id)
+        while cursor is not None:
+            page, cursor = manager.get_existing_images(cursor, workspace_id = workspace_id)
+            image_hashes.extend(page)
+        index.add_scanned(workspace_id, image_hashes)
+
+    copied = []
+    for i in candidates:
+        upload_image = job.images[i]
+        element_id = index.get(workspace_id, upload_image.content_hash)
+        if element_id is None:
+            continue
+
+        x, y = image_layout[i]
+        width, height = job.image_size
+        try:
+            new_element_id = manager.copy_image_at(element_id, upload_image.filename, (x, y, width, height), upload_image.traits, workspace_id = workspace_id)
+        except BluescapeApiException as e:
+            # Probably deleted from the workspace since, we'll upload it instead
+            print(f"Could not copy existing image {element_id}, uploading it instead: {e} - (upload_id: {job.upload_id})")
+            index.remove(workspace_id, upload_image.content_hash)
+            continue
+
+        mark_done(f"image:{i}", new_element_id)
+        copied.append(i)
+        print(f"Image {upload_image.filename} was already in the workspace and has been copied - (upload_id: {job.upload_id})")
+
+    return copied
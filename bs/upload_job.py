@@ -0,0 +1,311 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import uuid
+from modules.processing import Processed, StableDiffusionProcessingImg2Img
+from .bluescape_layout import BluescapeLayout
+from .asset_index import content_hash_trait, get_content_hash
+from .config import Config
+import os
+from .image_encoder import PendingImageData, encode_image, get_file_extension, get_image_encoding, get_upload_size
+from .misc import ImageEncoding, is_hex_color
+from .traits import get_canvas_traits, get_image_traits
+
+class UploadImage:
+
+    def __init__(self, image, filename, traits, kind, seed = None, subseed = None):
+        self.image = image
+        self.filename = filename
+        self.traits = traits
+        # One of "source_image", "image_mask" or "generated"
+        self.kind = kind
+        self.seed = seed
+        self.subseed = subseed
+        # Set when the image has already been encoded to a file, e.g. in the upload spool
+        # or the PNG A1111 saved to its output directory
+        self.path = None
+        # Set for images that may already be in the workspace, e.g. source images
+        self.content_hash = None
+
+    def get_data(self, encoding: ImageEncoding, max_size = None):
+        """
+        :return: The encoded image, either bytes-like or an open file when it has been encoded to a file before.
+        """
+        # Fall back to encoding if the file has been removed in the meantime
+        if self.path is not None and (self.image is None or os.path.exists(self.path)):
+            return open(self.path, "rb")
+
+        return encode_image(self.image, encoding, max_size)
+
+    def get_pending_data(self, encoding: ImageEncoding, max_size = None, budget = None) -> PendingImageData:
+        """
+        :return: The image data, to be encoded (or read) just in time for the upload.
+        """
+        if self.path is not None and (self.image is None or os.path.exists(self.path)):
+            estimated_size = os.path.getsize(self.path)
+        else:
+            # Uncompressed size, the encoded image is usually a good bit smaller
+            width, height = get_upload_size(self.image.size, max_size)
+            estimated_size = width * height * len(self.image.getbands())
+
+        return PendingImageData(lambda: self.get_data(encoding, max_size), estimated_size, budget)
+
+    def to_dict(self):
+        return {
+            "filename": self.filename,
+            "traits": self.traits,
+            "kind": self.kind,
+            "seed": self.seed,
+            "subseed": self.subseed,
+            "path": self.path,
+            "content_hash": self.content_hash,
+        }
+
+    @staticmethod
+    def from_dict(data):
+        upload_image = UploadImage(None, data["filename"], data["traits"], data["kind"], data["seed"], data["subseed"])
+        upload_image.path = data["path"]
+        upload_image.content_hash = data.get("content_hash")
+        return upload_image
+
+class UploadJob:
+    """
+    Everything needed to upload a single generation to Bluescape, captured
+    from Processed and the extension settings at the time of postprocess.
+    The job does not hold on to Processed itself, so it can outlive it.
+    """
+
+    def __init__(self, upload_id, is_txt2img, generation_type):
+        self.upload_id = upload_id
+        self.is_txt2img = is_txt2img
+        self.generation_type = generation_type
+
+        self.workspace_id = ""
+        self.user_id = ""
+        self.enable_verbose = False
+        self.user_swimlane = True
+        self.image_encoding = ImageEncoding.Png
+        self.image_size = (1000, 1000)
+        # Images larger than this are downscaled before upload, None to upload as is
+        self.max_upload_size = None
+        self.canvas_color = "#ffffff"
+
+        self.canvas_title = ""
+        self.header = ""
+        self.top_title = ""
+        self.canvas_traits = {}
+        self.infotext = ""
+        self.extended_generation_data = []
+
+        self.images = []
+
+    def get_num_images(self):
+        return len(self.images)
+
+    def hash_source_images(self):
+        """
+        Hashes the source images and masks, as they are often the same from one run to the next.
+        Reads every pixel, so this is done by the upload threads rather than during postprocess.
+        """
+        if not Config.dedup_source_images:
+            return
+
+        for upload_image in self.images:
+            if upload_image.kind in ("source_image", "image_mask") and upload_image.content_hash is None and upload_image.image is not None:
+                upload_image.content_hash = get_content_hash(upload_image.image)
+                upload_image.traits[content_hash_trait] = upload_image.content_hash
+
+    def create_layout(self) -> BluescapeLayout:
+        return BluescapeLayout(self.get_num_images(), self.image_size, self.enable_verbose)
+
+    def to_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "is_txt2img": self.is_txt2img,
+            "generation_type": self.generation_type,
+            "workspace_id": self.workspace_id,
+            "user_id": self.user_id,
+            "enable_verbose": self.enable_verbose,
+            "user_swimlane": self.user_swimlane,
+            "image_encoding": self.image_encoding.value,
+            "image_size": list(self.image_size),
+            "max_upload_size": list(self.max_upload_size) if self.max_upload_size else None,
+            "canvas_color": self.canvas_color,
+            "canvas_title": self.canvas_title,
+            "header": self.header,
+            "top_title": self.top_title,
+            "canvas_traits": self.canvas_traits,
+            "infotext": self.infotext,
+            # Values are only ever rendered as text, and may not be serializable otherwise
+            "extended_generation_data": [[str(key), str(value)] for key, value in self.extended_generation_data],
+            "images": [upload_image.to_dict() for upload_image in self.images],
+        }
+
+    @staticmethod
+    def from_dict(data):
+        job = UploadJob(data["upload_id"], data["is_txt2img"], data["generation_type"])
+        job.workspace_id = data["workspace_id"]
+        job.user_id = data["user_id"]
+        job.enable_verbose = data["enable_verbose"]
+        job.user_swimlane = data["user_swimlane"]
+        job.image_encoding = get_image_encoding(data.get("image_encoding"))
+        job.image_size = tuple(data["image_size"])
+        job.max_upload_size = tuple(data["max_upload_size"]) if data.get("max_upload_size") else None
+        job.canvas_color = data["canvas_color"]
+        job.canvas_title = data["canvas_title"]
+        job.header = data["header"]
+        job.top_title = data["top_title"]
+        job.canvas_traits = data["canvas_traits"]
+        job.infotext = data["infotext"]
+        job.extended_generation_data = [tuple(pair) for pair in data["extended_generation_data"]]
+        job.images = [UploadImage.from_dict(image_data) for image_data in data["images"]]
+        return job
+
+def create_upload_job(p, processed: Processed, state, is_txt2img, is_img2img, saved_images = None) -> UploadJob:
+
+    # Lets generate a consistent id for this upload session
+    upload_id = str(uuid.uuid4())
+
+    # Check for some common settings
+    enable_verbose = state.enable_verbose
+    enable_metadata = state.enable_metadata
+    img2img_include_init_images = state.img2img_include_init_images
+    img2img_include_mask_image = state.img2img_include_mask_image
+    scale_to_standard_size = state.scale_to_standard_size
+    use_canvas_border_color = state.use_canvas_border_color
+    canvas_border_color = state.canvas_border_color
+    user_id = state.user_id
+
+    # Detect what we are using to generate
+    generation_type = "unknown"
+    p_img2img = None
+    if is_txt2img and not is_img2img:
+        generation_type = "txt2img"
+    elif is_img2img and not is_txt2img:
+        generation_type = "img2img"
+        p_img2img: StableDiffusionProcessingImg2Img = p
+    else:
+        print(f"Unkown image generation type - txt2img: {is_txt2img}, img2img: {is_img2img} - (upload_id: {upload_id})")
+
+    job = UploadJob(upload_id, is_txt2img, generation_type)
+    job.workspace_id = state.selected_workspace_id
+    job.user_id = user_id
+    job.enable_verbose = enable_verbose
+    job.user_swimlane = state.user_swimlane
+    job.image_encoding = get_image_encoding(state.image_encoding)
+    extension = get_file_extension(job.image_encoding)
+    job.image_size = (1000, 1000) if scale_to_standard_size else (processed.width, processed.height)
+    job.max_upload_size = get_max_upload_size(state, job.image_size)
+    job.canvas_color = canvas_border_color if is_hex_color(canvas_border_color) and use_canvas_border_color else "#ffffff"
+
+    # First check for init images (source images)
+    if img2img_include_init_images and generation_type == "img2img" and p_img2img:
+        for index, image in enumerate(p_img2img.init_images):
+            seed = "source_image"
+            subseed = "unknown"
+            infotext = "source_image"
+
+            traits = get_image_traits(enable_metadata, processed, seed, subseed, infotext, generation_type, upload_id, user_id)
+
+            # Filename based on the index
+            job.images.append(UploadImage(image, f"source-image_{index}.{extension}", traits, "source_image"))
+
+    if img2img_include_mask_image and p_img2img is not None and p_img2img.image_mask is not None:
+        seed = "image_mask"
+        subseed = "unknown"
+        infotext = "image_mask"
+
+        traits = get_image_traits(enable_metadata, processed, seed, subseed, infotext, generation_type, upload_id, user_id)
+
+        job.images.append(UploadImage(p_img2img.image_mask, f"image_mask.{extension}", traits, "image_mask"))
+
+    # Now we'll deal with the generated images
+    index_of_first_image = processed.index_of_first_image
+    for index, image in enumerate(processed.images):
+        if index >= index_of_first_image:
+            adjusted_index = index - index_of_first_image
+
+            seed = processed.all_seeds[adjusted_index]
+            subseed = processed.all_subseeds[adjusted_index]
+            infotext = processed.infotexts[adjusted_index]
+
+            traits = get_image_traits(enable_metadata, processed, seed, subseed, infotext, generation_type, upload_id, user_id)
+
+            # Filename based on seed and subseed
+            job.images.append(UploadImage(image, f"{seed}-{subseed}.{extension}", traits, "generated", seed, subseed))
+        else:
+            print(f"Ignoring generated image with index {index}, as it is smaller than index of first generated image: {index_of_first_image} - (upload_id: {upload_id})")
+
+    # Keep track of the original resolution of any image we downscale
+    for upload_image in job.images:
+        original_size = upload_image.image.size
+        if get_upload_size(original_size, job.max_upload_size) != original_size:
+            upload_image.traits["http://bluescape.dev/automatic1111-extension/v1/originalSize"] = f"{original_size[0]}x{original_size[1]}"
+        elif saved_images is not None and upload_image.kind == "generated" and job.image_encoding == ImageEncoding.Png:
+            # A1111 has usually saved the image already, with the generation data
+            # embedded. If it saved a PNG we can upload that file and skip encoding.
+            path = saved_images.get_path(upload_image.image)
+            if path is not None and path.lower().endswith(".png"):
+                upload_image.path = path
+
+    num_images = job.get_num_images()
+
+    layout = job.create_layout()
+    job.canvas_title = layout.get_canvas_name(state, processed.prompt, generation_type)
+    (job.header, job.top_title) = layout.get_top_title(processed.prompt, generation_type, state)
+    job.canvas_traits = get_canvas_traits(enable_metadata, processed, generation_type, upload_id, num_images, user_id)
+    job.infotext = processed.infotexts[0]
+
+    if (enable_verbose):
+        job.extended_generation_data = [
+            ( "Image CFG scale", processed.image_cfg_scale ),
+            ( "Subseed strength", processed.subseed_strength ),
+            ( "Seed resize from w", processed.seed_resize_from_w ),
+            ( "Seed resize from h", processed.seed_resize_from_h ),
+            ( "DDIM Discretize", processed.ddim_discretize ),
+            ( "ETA", processed.eta ),
+            ( "Clip skip", processed.clip_skip ),
+            ( "Sigma churn", processed.s_churn ),
+            ( "Sigma noise", processed.s_noise ),
+            ( "Sigma tmin", processed.s_tmin ),
+            ( "Sigma tmax", processed.s_tmax ),
+            ( "Sampler noise scheduler override", processed.sampler_noise_scheduler_override ),
+            ( "Is using inpainting conditioning", processed.is_using_inpainting_conditioning ),
+            ( "Extra generation params", processed.extra_generation_params ),
+            ( "Bluescape upload id", upload_id ),
+        ]
+
+    return job
+
+def get_max_upload_size(state, image_size):
+    max_size = None
+
+    # The images are shown at the standard size in the workspace anyway
+    if state.scale_to_standard_size and state.downscale_to_standard_size:
+        max_size = image_size
+
+    if Config.max_upload_dimension > 0:
+        cap = (Config.max_upload_dimension, Config.max_upload_dimension)
+        max_size = cap if max_size is None else (min(max_size[0], cap[0]), min(max_size[1], cap[1]))
+
+    return max_size
@@ -0,0 +1,62 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import queue
+import threading
+
+class UploadQueue:
+    """
+    Runs upload jobs on a single background worker thread, in the order
+    they were submitted, so that the generation thread does not have to
+    wait for Bluescape.
+    """
+
+    def __init__(self, name = "bluescape-upload-queue"):
+        self.name = name
+        self.jobs = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        self.jobs.put((fn, args))
+        self._ensure_worker()
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.worker.start()
+
+    def _run(self):
+        while True:
+            fn, args = self.jobs.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Bluescape background job failed ({self.name}):")
+                print(e)
+            finally:
+                self.jobs.task_done()
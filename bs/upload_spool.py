@@ -0,0 +1,133 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import json
+import os
+import shutil
+import threading
+import time
+from .config import Config
+from .database import connect
+from .image_encoder import encode_images, get_file_extension
+from .upload_job import UploadJob
+
+class UploadSpool:
+    """
+    On-disk queue of upload jobs, so that uploads survive an A1111 restart
+    or a Bluescape outage. Each job is stored with its images encoded to
+    files right after it is queued, and every element created in
+    Bluescape is recorded as it completes, so a resumed job picks up where
+    it left off without duplicating elements.
+    """
+
+    def __init__(self, data_dir):
+        self.spool_dir = os.path.join(data_dir, "upload_spool")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.db_file = os.path.join(self.spool_dir, "spool.db")
+        self.lock = threading.Lock()
+
+        with connect(self.db_file) as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    upload_id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    job TEXT NOT NULL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS elements (
+                    upload_id TEXT NOT NULL,
+                    element_key TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (upload_id, element_key)
+                )
+            """)
+
+    def add(self, job: UploadJob):
+        """
+        Stores the job. This is quick, as it runs on the generation thread, the
+        images are written afterwards with store_images on the encode thread.
+        """
+        with self.lock, connect(self.db_file) as db:
+            db.execute("INSERT OR REPLACE INTO jobs (upload_id, created_at, job) VALUES (?, ?, ?)", (job.upload_id, time.time(), json.dumps(job.to_dict())))
+
+    def store_images(self, job: UploadJob):
+        """
+        Encodes the images of the job to files in the spool, after which the job doesn't need the pixels anymore.
+        """
+        # The last chance to hash the pixels
+        job.hash_source_images()
+
+        pending = [(index, upload_image) for index, upload_image in enumerate(job.images) if upload_image.path is None and upload_image.image is not None]
+        if not pending:
+            return
+
+        job_dir = os.path.join(self.spool_dir, job.upload_id)
+        os.makedirs(job_dir, exist_ok=True)
+        extension = get_file_extension(job.image_encoding)
+
+        # A few at a time, so we only hold on to a handful of encoded images at once
+        chunk_size = max(1, Config.encode_workers)
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            encoded = encode_images([upload_image.image for _, upload_image in chunk], job.image_encoding, job.max_upload_size)
+
+            for (index, upload_image), data in zip(chunk, encoded):
+                path = os.path.join(job_dir, f"{index}.{extension}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                upload_image.path = path
+                upload_image.image = None
+
+        with self.lock, connect(self.db_file) as db:
+            db.execute("UPDATE jobs SET job = ? WHERE upload_id = ?", (json.dumps(job.to_dict()), job.upload_id))
+
+    def get_pending_jobs(self):
+        with self.lock, connect(self.db_file) as db:
+            rows = db.execute("SELECT job FROM jobs ORDER BY created_at").fetchall()
+
+        jobs = []
+        for (data,) in rows:
+            try:
+                jobs.append(UploadJob.from_dict(json.loads(data)))
+            except (KeyError, ValueError) as e:
+                print(f"Skipping unreadable upload job in spool: {e}")
+        return jobs
+
+    def remove(self, upload_id):
+        with self.lock, connect(self.db_file) as db:
+            db.execute("DELETE FROM jobs WHERE upload_id = ?", (upload_id,))
+            db.execute("DELETE FROM elements WHERE upload_id = ?", (upload_id,))
+        shutil.rmtree(os.path.join(self.spool_dir, upload_id), ignore_errors=True)
+
+    def mark_done(self, upload_id, element_key, value):
+        with self.lock, connect(self.db_file) as db:
+            db.execute("INSERT OR REPLACE INTO elements (upload_id, element_key, value) VALUES (?, ?, ?)", (upload_id, element_key, json.dumps(value)))
+
+    def get_done(self, upload_id):
+        """
+        :return: A dictionary of element keys completed for the job, and the values recorded for them.
+        """
+        with self.lock, connect(self.db_file) as db:
+            rows = db.execute("SELECT element_key, value FROM elements WHERE upload_id = ?", (upload_id,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
@@ -0,0 +1,151 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import json
+import os
+import threading
+import time
+from .bluescape_api import bs_get_workspaces
+from .config import Config
+
+class WorkspaceCache:
+    """
+    The workspaces of the user, cached on disk so the workspace dropdown can be
+    filled right away. The first pages are loaded up front, further pages only
+    when asked for.
+    """
+
+    def __init__(self, data_dir):
+        self.cache_file = os.path.join(data_dir, "workspaces.json")
+        self.workspaces = []
+        self.fetched_at = 0
+        # ETag of the first page, to check whether the workspaces changed
+        self.etag = None
+        # Cursor of the next page, None when all workspaces are loaded
+        self.cursor = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+            self.workspaces = data["workspaces"]
+            self.fetched_at = data["fetched_at"]
+            self.etag = data["etag"]
+            self.cursor = data["cursor"]
+        except (json.JSONDecodeError, KeyError):
+            print("Invalid workspace cache, workspaces will be loaded again")
+
+    def save(self):
+        # Written to a temporary file first, so a crash never leaves half a cache behind
+        temp_file = f"{self.cache_file}.tmp"
+        with open(temp_file, "w") as out_file:
+            json.dump({
+                "workspaces": self.workspaces,
+                "fetched_at": self.fetched_at,
+                "etag": self.etag,
+                "cursor": self.cursor
+            }, out_file)
+        os.replace(temp_file, self.cache_file)
+
+    def clear(self):
+        with self.lock:
+            self.workspaces = []
+            self.fetched_at = 0
+            self.etag = None
+            self.cursor = None
+            if os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > Config.workspace_cache_ttl
+
+    def has_more(self):
+        return self.cursor is not None
+
+    def refresh(self, token):
+        """
+        Loads the first pages of workspaces again, unless the first page hasn't changed.
+        """
+        with self.lock:
+            workspaces, cursor, etag = bs_get_workspaces(token, etag = self.etag if self.workspaces else None)
+
+            if workspaces is None:
+                print("Workspaces haven't changed")
+                self.fetched_at = time.time()
+                self.save()
+                return
+
+            for _ in range(1, Config.workspace_initial_pages):
+                if cursor is None:
+                    break
+                page, cursor, _ = bs_get_workspaces(token, cursor)
+                workspaces = workspaces + page
+
+            self.workspaces = self._to_cached(workspaces)
+            self.cursor = cursor
+            self.etag = etag
+            self.fetched_at = time.time()
+            self.save()
+
+            print(f"Total {len(self.workspaces)} workspaces retrieved")
+
+    def refresh_in_background(self, token, on_refreshed = None):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh(token)
+                if on_refreshed is not None:
+                    on_refreshed()
+            except Exception as e:
+                print(f"Refreshing workspaces failed: {e}")
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target = run, daemon = True).start()
+
+    def load_more(self, token, pages = 1):
+        """
+        Loads the next pages of workspaces, after the ones loaded so far.
+        """
+        with self.lock:
+            for _ in range(pages):
+                if self.cursor is None:
+                    break
+                page, self.cursor, _ = bs_get_workspaces(token, self.cursor)
+                self.workspaces = self.workspaces + self._to_cached(page)
+            self.save()
+
+            print(f"Total {len(self.workspaces)} workspaces loaded")
+
+    def _to_cached(self, workspaces):
+        # Only what the dropdown needs
+        return [{"id": w["id"], "name": w["name"]} for w in workspaces]
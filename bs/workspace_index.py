@@ -0,0 +1,76 @@
+#
+# MIT License
+#
+# Copyright (c) 2023 Thought Stream, LLC dba Bluescape.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import re
+from bisect import bisect_left
+
+def get_words(text):
+    return [word for word in re.split(r"[^0-9a-z]+", text.lower()) if word]
+
+def is_subsequence(query, text):
+    it = iter(text)
+    return all(c in it for c in query)
+
+class WorkspaceIndex:
+    """
+    Search index over the workspace dropdown labels, i.e. "name (id)". Words of
+    the labels are kept sorted, so prefix matches are found with a binary search.
+    Substring and fuzzy (in order, with gaps) matches are only looked for when
+    there aren't enough prefix matches.
+    """
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.words = sorted((word, i) for i, label in enumerate(self.labels) for word in set(get_words(label)))
+
+    def search(self, query, limit = 20):
+        """
+        :return: Up to limit labels, best matches first.
+        """
+        query = query.strip().lower()
+        if not query:
+            return self.labels[:limit]
+
+        scores = {}
+
+        # Labels starting with the query rank above labels with a word starting with it
+        start = bisect_left(self.words, (query,))
+        for word, i in self.words[start:]:
+            if not word.startswith(query):
+                break
+            score = 3 if self.labels[i].lower().startswith(query) else 2
+            scores[i] = max(scores.get(i, 0), score)
+
+        if len(scores) < limit:
+            compact_query = query.replace(" ", "")
+            for i, label in enumerate(self.labels):
+                if i in scores:
+                    continue
+                lower_label = label.lower()
+                if query in lower_label:
+                    scores[i] = 1
+                elif is_subsequence(compact_query, lower_label):
+                    scores[i] = 0
+
+        ranked = sorted(scores, key = lambda i: (-scores[i], i))
+        return [self.labels[i] for i in ranked[:limit]]
@@ -27,4 +27,7 @@ if not launch.is_installed("appdirs"):
     launch.run_pip("install appdirs==1.4.4", "requirements for Bluescape extension")
 
 if not launch.is_installed("pkce"):
-    launch.run_pip("install pkce==1.0.3", "requirements for Bluescape extension")
\ No newline at end of file
+    launch.run_pip("install pkce==1.0.3", "requirements for Bluescape extension")
+
+if not launch.is_installed("ijson"):
+    launch.run_pip("install ijson==3.2.3", "requirements for Bluescape extension")
\ No newline at end of file
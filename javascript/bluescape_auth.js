@@ -67,17 +67,104 @@ document.addEventListener("DOMContentLoaded", function () {
         RetryCallback(ClickOnBluescapeTab, 500, 6);
     }
 
-    // Status polling
-    statusInterval = setInterval(async () => {
+    // Status updates, only while the page is visible
+    document.addEventListener("visibilitychange", function () {
+        if (document.hidden) {
+            StopStatusUpdates();
+        } else {
+            StartStatusUpdates();
+        }
+    });
+
+    if (!document.hidden) {
+        StartStatusUpdates();
+    }
+});
+
+let statusEventSource = null;
+let statusFirstEventTimer = null;
+// Aborts the long polling loop, and its request, when status updates stop
+let statusPollController = null;
+let statusETag = null;
+
+function StartStatusUpdates() {
+    if (statusEventSource || statusPollController) {
+        return;
+    }
+
+    if (!window.EventSource) {
+        PollStatus();
+        return;
+    }
+
+    // The server pushes the status whenever it changes
+    let received = false;
+    const eventSource = new EventSource("/bluescape/status/stream");
+    statusEventSource = eventSource;
+    eventSource.onmessage = (event) => {
+        received = true;
+        clearTimeout(statusFirstEventTimer);
+        bluescape_update_status(event.data);
+    };
+    eventSource.onerror = () => {
+        // EventSource reconnects by itself, unless streaming isn't possible at all
+        if (statusEventSource === eventSource && (!received || eventSource.readyState === EventSource.CLOSED)) {
+            FallBackToPolling();
+        }
+    };
+
+    // The server sends the status right away, a proxy that buffers the stream
+    // holds it back without the connection ever failing
+    statusFirstEventTimer = setTimeout(() => {
+        if (statusEventSource === eventSource && !received) {
+            FallBackToPolling();
+        }
+    }, 5000);
+}
+
+function FallBackToPolling() {
+    StopStatusUpdates();
+    PollStatus();
+}
+
+function StopStatusUpdates() {
+    clearTimeout(statusFirstEventTimer);
+    if (statusEventSource) {
+        statusEventSource.close();
+        statusEventSource = null;
+    }
+    if (statusPollController) {
+        statusPollController.abort();
+        statusPollController = null;
+    }
+}
+
+// Fallback for when the status can't be streamed: long polling, where the
+// server holds the request until the status changes
+async function PollStatus() {
+    const controller = new AbortController();
+    statusPollController = controller;
+    while (!controller.signal.aborted && !document.hidden) {
         try {
-            const response = await fetch("/bluescape/status");
-            bluescape_update_status(await response.text());
+            const headers = statusETag ? { "If-None-Match": statusETag } : {};
+            const response = await fetch("/bluescape/status?wait=25", { headers: headers, cache: "no-store", signal: controller.signal });
+            if (response.status === 200) {
+                statusETag = response.headers.get("ETag");
+                bluescape_update_status(await response.text());
+            } else if (response.status !== 304) {
+                await new Promise((resolve) => setTimeout(resolve, 2000));
+            }
         }
         catch (error) {
-            // Do nothing
+            if (!controller.signal.aborted) {
+                await new Promise((resolve) => setTimeout(resolve, 2000));
+            }
         }
-    }, 2000);
-});
+    }
+    if (statusPollController === controller) {
+        statusPollController = null;
+    }
+}
 
 function RetryCallback(callback, delay, tries) {
     if (tries && callback() !== true) {